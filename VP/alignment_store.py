@@ -0,0 +1,182 @@
+#!usr/bin/python
+
+import json
+import struct
+import numpy as np
+import pandas as pd
+
+from config import ALPHABET
+
+# File extension of the binary alignments
+EXT = '.vpa'
+
+# Layout of a file:
+#   MAGIC
+#   _PREFIX (header_len, n_seqs, n_cols, ids_len)
+#   header as JSON
+#   residue matrix, uint8 of shape (n_seqs, n_cols)
+#   id offsets, uint64 of shape (n_seqs + 1,)
+#   ids, concatenated
+# Sections after the header start on 8 byte boundaries.
+MAGIC = 'VPALN\x00\x01\x00'
+_PREFIX = struct.Struct('<QQQQ')
+
+def _align(n):
+	""" Round n up to a multiple of 8. """
+	return (n + 7) // 8 * 8
+
+def is_store(fname):
+	""" Check if a file is a binary alignment. """
+	return fname.endswith(EXT)
+
+def codes_from_df(df):
+	""" Convert an alignment dataframe (one residue
+		per cell) to a matrix of residue codes.
+
+		The alphabet is ALPHABET followed by any other
+		characters in the alignment (eg. 'X' before
+		preprocessing), so that clean alignments
+		always have the same codes.
+
+		Returns the codes and the alphabet.
+	"""
+	chars = np.asarray(df.values, dtype='S1').view(np.uint8)
+
+	alphabet = ALPHABET
+	for c in np.unique(chars):
+		if chr(c) not in alphabet:
+			alphabet += chr(c)
+
+	table = np.zeros(256, dtype=np.uint8)
+	for i, c in enumerate(alphabet):
+		table[ord(c)] = i
+
+	return table[chars], alphabet
+
+def save_as_store(df, fname, meta=None):
+	""" Save an alignment dataframe, as returned by
+		get_df_from_file(), as a binary alignment.
+
+		Parameters
+		----------
+		df: pd.DataFrame
+			Alignment indexed by identifier.
+
+		fname: str
+			File to write to.
+
+		meta: dict
+			Extra information to keep in the header.
+	"""
+	codes, alphabet = codes_from_df(df)
+	n_seqs, n_cols = codes.shape
+
+	ids = [str(i) for i in df.index]
+	lens = np.array([len(i) for i in ids], dtype=np.uint64)
+	offsets = np.concatenate([[0], np.cumsum(lens)]).astype(np.uint64)
+	ids = ''.join(ids)
+
+	header = {'alphabet': alphabet,
+			'gap': alphabet.index('-'),
+			'columns': list(df.columns),
+			'meta': meta or {}}
+	header = json.dumps(header)
+
+	start = len(MAGIC) + _PREFIX.size
+	matrix_off = _align(start + len(header))
+	offsets_off = _align(matrix_off + codes.size)
+
+	with open(fname, 'wb') as f:
+		f.write(MAGIC)
+		f.write(_PREFIX.pack(len(header), n_seqs, n_cols, len(ids)))
+		f.write(header)
+		f.write('\x00' * (matrix_off - start - len(header)))
+		f.write(codes.tobytes())
+		f.write('\x00' * (offsets_off - matrix_off - codes.size))
+		f.write(offsets.tobytes())
+		f.write(ids)
+
+class AlignmentStore():
+
+	def __init__(self, fname):
+		""" Memory mapped binary alignment written by
+			save_as_store(). Sequences are read by
+			identifier without loading the whole file.
+		"""
+
+		self.fname = fname
+
+		with open(fname, 'rb') as f:
+			if f.read(len(MAGIC)) != MAGIC:
+				raise ValueError(fname + " is not a binary alignment.")
+			header_len, n_seqs, n_cols, ids_len = \
+				_PREFIX.unpack(f.read(_PREFIX.size))
+			self.header = json.loads(f.read(header_len))
+
+		start = len(MAGIC) + _PREFIX.size
+		matrix_off = _align(start + header_len)
+		offsets_off = _align(matrix_off + n_seqs * n_cols)
+		ids_off = offsets_off + (n_seqs + 1) * 8
+
+		self.shape = (n_seqs, n_cols)
+		self.alphabet = str(self.header['alphabet'])
+		self.columns = [str(c) for c in self.header['columns']]
+
+		self.codes = np.memmap(fname, dtype=np.uint8, mode='r',
+							offset=matrix_off, shape=self.shape)
+
+		# The id table is small, so it is read at once
+		offsets = np.memmap(fname, dtype=np.uint64, mode='r',
+							offset=offsets_off, shape=(n_seqs + 1,))
+		raw = np.memmap(fname, dtype=np.uint8, mode='r',
+						offset=ids_off, shape=(ids_len,)).tobytes()
+		self.ids = [raw[int(offsets[i]):int(offsets[i + 1])]
+					for i in range(n_seqs)]
+		self.pos = dict((k, i) for i, k in enumerate(self.ids))
+
+	def __len__(self):
+		return self.shape[0]
+
+	def row(self, seq_id):
+		""" Residue codes of one sequence. """
+		return self.codes[self.pos[seq_id]]
+
+	def sequence(self, seq_id):
+		""" One sequence as a string. """
+		chars = np.frombuffer(self.alphabet, dtype=np.uint8)
+		return chars[self.row(seq_id)].tobytes()
+
+	def encode(self, lookup):
+		""" Encode all sequences at once.
+
+			Parameters
+			----------
+			lookup: np.ndarray
+				Values indexed by the byte value of each
+				residue, eg. from features._get_lookup().
+
+			Returns
+			-------
+			np.ndarray of shape (n_seqs, n_cols).
+		"""
+		table = lookup[np.frombuffer(self.alphabet, dtype=np.uint8)]
+		return table[self.codes]
+
+	def to_df(self):
+		""" The alignment as a dataframe, in the form
+			returned by get_df_from_file().
+		"""
+		chars = np.array(list(self.alphabet))
+		df = pd.DataFrame(chars[self.codes], columns=self.columns)
+		df['names'] = self.ids
+		df = df.set_index('names')
+
+		return df
+
+	def to_fasta(self, fname):
+		""" Export the alignment as a fasta file. """
+		chars = np.frombuffer(self.alphabet, dtype=np.uint8)
+		with open(fname, 'w') as f:
+			for i, seq_id in enumerate(self.ids):
+				f.write('>' + seq_id + '\n')
+				f.write(chars[self.codes[i]].tobytes() + '\n')
@@ -0,0 +1,151 @@
+#!usr/bin/python
+
+import os
+import pickle
+import hashlib
+
+from config import CACHE_DIR, CACHE_SIZE, DATA_REPO, THRESHOLD, PRECISION
+
+# Bump to invalidate all entries when the
+# feature pipeline changes.
+CACHE_VERSION = 2
+
+# Files outside the inputs which change the features
+_REGISTRY = [DATA_REPO + '/orders', DATA_REPO + '/viruses_dict']
+
+def _file_digest(path):
+	""" SHA-1 of the contents of a file. """
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), ''):
+			h.update(chunk)
+	return h.hexdigest()
+
+def _dump(value, path):
+	""" Pickle a value to path. The file is renamed
+		into place, so that other processes never read
+		it half written. """
+	tmp = path + '.' + str(os.getpid())
+	with open(tmp, 'w') as f:
+		pickle.dump(value, f)
+	os.rename(tmp, path)
+
+def _load(path):
+	""" Unpickle path, or None if another process
+		removed it. """
+	try:
+		with open(path) as f:
+			return pickle.load(f)
+	except (IOError, OSError):
+		return None
+
+class EmbeddingCache():
+
+	def __init__(self, dirname=CACHE_DIR, max_bytes=CACHE_SIZE):
+		""" Content addressed cache of final embeddings.
+
+			Entries are keyed by the hashes of the input
+			files and all the parameters, and the least
+			recently used ones are evicted once the cache
+			grows beyond max_bytes.
+
+			Every file is written to a temporary name and
+			renamed into place, so processes sharing the
+			cache (eg. the virus and mouse runs of the
+			pipeline) can read and evict concurrently.
+		"""
+
+		self.dirname = dirname
+		self.max_bytes = max_bytes
+
+		if not os.path.exists(self.dirname):
+			os.makedirs(self.dirname)
+
+		# Digests of files, reused while their size
+		# and modification time are unchanged.
+		self._digests_fname = self.dirname + '/digests'
+		self._digests = _load(self._digests_fname) or {}
+
+	def _digest(self, path):
+		""" Digest of a file, from the memo if it
+			has not changed. """
+		st = os.stat(path)
+		stamp = (st.st_size, st.st_mtime)
+
+		memo = self._digests.get(path)
+		if memo is None or memo[0] != stamp:
+			memo = (stamp, _file_digest(path))
+			self._digests[path] = memo
+
+		return memo[1]
+
+	def key(self, input_dir, **params):
+		""" Key for the embeddings of the files in
+			input_dir computed with params. THRESHOLD,
+			PRECISION and the orders registry are always
+			included.
+		"""
+		h = hashlib.sha1()
+		h.update(repr((CACHE_VERSION, THRESHOLD, PRECISION)))
+		h.update(repr(sorted(params.items())))
+
+		paths = [input_dir + '/' + fname
+				for fname in sorted(os.listdir(input_dir))]
+		for path in _REGISTRY + paths:
+			h.update(os.path.basename(path))
+			h.update(self._digest(path))
+
+		# Keep the digests saved by other processes
+		digests = _load(self._digests_fname) or {}
+		digests.update(self._digests)
+		_dump(digests, self._digests_fname)
+
+		return h.hexdigest()
+
+	def _path(self, key):
+		return self.dirname + '/' + key + '.pkl'
+
+	def get(self, key):
+		""" The cached value for key, or None. """
+		path = self._path(key)
+		if not os.path.exists(path):
+			return None
+
+		# Mark as recently used, unless it was
+		# just evicted by another process
+		try:
+			os.utime(path, None)
+		except OSError:
+			return None
+		return _load(path)
+
+	def put(self, key, value):
+		""" Cache a value and evict old entries. """
+		_dump(value, self._path(key))
+
+		self.evict()
+
+	def evict(self):
+		""" Delete the least recently used entries
+			until the cache fits in max_bytes. Entries
+			still being written have a temporary name
+			and are left alone. """
+		entries = []
+		for fname in os.listdir(self.dirname):
+			if fname.endswith('.pkl'):
+				try:
+					st = os.stat(self.dirname + '/' + fname)
+				except OSError:
+					continue
+				entries.append((st.st_mtime, st.st_size, fname))
+
+		total = sum([size for _t, size, _f in entries])
+		for _t, size, fname in sorted(entries):
+			if total <= self.max_bytes:
+				break
+			# Another process may have evicted it already
+			try:
+				os.remove(self.dirname + '/' + fname)
+			except OSError:
+				pass
+			total -= size
@@ -2,6 +2,11 @@ import pickle
 import numpy as np
 import pandas as pd
 
+# Hosts which are not in the graph. Their rows are kept
+# apart in unseen_hosts.csv, which cold_start.py reads
+# to predict virulence in them, instead of being dropped.
+UNSEEN_HOSTS = ['ICR', 'SJL/JOrlCrl']
+
 def change_values_and_save():
 	df = pd.read_csv('data/collected.csv')
 
@@ -9,11 +14,11 @@ def change_values_and_save():
 							 'C57BL/6 MX1++': 'C57BL/6',
 							 'DBA.2': 'DBA/2J',
 							 'DBA/2': 'DBA/2J',
-							 'C57BL/6 IFNAR-/-': np.nan,
-							 'ICR': np.nan,
-							 'SJL/JOrlCrl': np.nan}
+							 'C57BL/6 IFNAR-/-': np.nan}
 
 	df['Host_strain'].replace(host_strain_correction, inplace=True)
 	df.dropna(inplace=True)
 
-	df.to_csv('changed.csv', sep=',')
\ No newline at end of file
+	unseen = df['Host_strain'].isin(UNSEEN_HOSTS)
+	df[unseen].to_csv('unseen_hosts.csv', sep=',')
+	df[~unseen].to_csv('changed.csv', sep=',')
\ No newline at end of file
@@ -0,0 +1,157 @@
+#!usr/bin/python
+
+import os
+import json
+import shutil
+import traceback
+import numpy as np
+
+from config import CHECKPOINT_DIR
+
+class Journal():
+
+	def __init__(self, name, params=None, restart=False,
+				dirname=CHECKPOINT_DIR):
+		""" Append only journal of the files finished
+			(or failed) by a stage, so that a crashed run
+			resumes from where it stopped.
+
+			Each line is a JSON entry for one input file
+			with its size and modification time, so that
+			files which changed since are done again.
+			The first line holds the parameters of the
+			run, and a journal with other parameters is
+			started afresh.
+
+			Parameters
+			----------
+			name: str
+				Name of the stage, eg. 'preprocess_virus'.
+
+			params: dict
+				Parameters which change the results.
+
+			restart: bool
+				Set True to forget earlier progress.
+		"""
+
+		self.fname = dirname + '/' + name + '.log'
+		self.result_dir = dirname + '/' + name
+		self.params = json.loads(json.dumps(params or {}))
+		self.entries = {}
+		self._header = None
+
+		if not os.path.exists(self.result_dir):
+			os.makedirs(self.result_dir)
+
+		if not restart and os.path.exists(self.fname):
+			self._read()
+
+		if restart or self._header != self.params:
+			self._start()
+
+	def _read(self):
+		""" Load the entries of an earlier run. A line
+			cut short by a crash is dropped. """
+		with open(self.fname) as f:
+			lines = f.read().split('\n')
+
+		# Anything after the last newline is a torn write
+		if lines[-1]:
+			with open(self.fname, 'w') as f:
+				f.write('\n'.join(lines[:-1] + ['']))
+
+		for i, line in enumerate(lines[:-1]):
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				continue
+			if i == 0:
+				self._header = entry.get('params')
+			else:
+				self.entries[entry['file']] = entry
+
+	def _start(self):
+		""" Start a new journal. """
+		shutil.rmtree(self.result_dir)
+		os.makedirs(self.result_dir)
+
+		self.entries = {}
+		self._header = self.params
+		with open(self.fname, 'w') as f:
+			f.write(json.dumps({'params': self.params}) + '\n')
+
+	def _append(self, entry):
+		""" Write an entry to disc before going on. """
+		self.entries[entry['file']] = entry
+		with open(self.fname, 'a') as f:
+			f.write(json.dumps(entry) + '\n')
+			f.flush()
+			os.fsync(f.fileno())
+
+	def _stamp(self, path):
+		st = os.stat(path)
+		return [st.st_size, st.st_mtime]
+
+	def _result_fname(self, path):
+		return self.result_dir + '/' + os.path.basename(path) + '.npz'
+
+	def is_done(self, path):
+		""" Check if a file was finished with the same
+			contents and its outputs still exist. """
+		entry = self.entries.get(path)
+		if entry is None or entry['status'] != 'done':
+			return False
+		if entry['stamp'] != self._stamp(path):
+			return False
+
+		return all([os.path.exists(out) for out in entry['outputs']])
+
+	def done(self, path, outputs=(), result=None):
+		""" Record a finished file.
+
+			Parameters
+			----------
+			path: str
+				Input file.
+
+			outputs: list
+				Files written for it.
+
+			result: tuple
+				(keys, block) to keep in the journal, where
+				block is an array with a row for each key.
+		"""
+		outputs = list(outputs)
+		if result is not None:
+			keys, block = result
+			fname = self._result_fname(path)
+			with open(fname, 'wb') as f:
+				np.savez(f, keys=np.array(keys, dtype=str), block=block)
+			outputs.append(fname)
+
+		self._append({'file': path, 'status': 'done',
+					'stamp': self._stamp(path), 'outputs': outputs})
+
+	def fail(self, path, error, trace=None):
+		""" Quarantine a file with its error. It is
+			tried again by the next run. trace is the
+			traceback, if the error was caught in
+			another thread or process. """
+		if trace is None:
+			trace = traceback.format_exc()
+		self._append({'file': path, 'status': 'failed',
+					'stamp': self._stamp(path),
+					'error': repr(error),
+					'traceback': trace})
+
+	def result(self, path):
+		""" The keys and block recorded by done(). """
+		with np.load(self._result_fname(path)) as data:
+			return data['keys'].tolist(), data['block']
+
+	def quarantined(self):
+		""" Errors of the files which failed, by file. """
+		return dict((path, entry['error'])
+					for path, entry in self.entries.items()
+					if entry['status'] == 'failed')
@@ -0,0 +1,242 @@
+#!usr/bin/python
+
+import os
+import re
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+
+from config import DATA_REPO
+from incremental import embed_strains, load_fit_state
+from reduce_dimension import features_fname
+from knn_index import KNNIndex, load_embeddings, knn_virulence
+
+def host_key(name):
+	""" Name of a host strain as in the mouse features,
+		eg. 'SJLJOrlCrl' for 'SJL/JOrlCrl'. """
+	return re.sub(r'[^0-9A-Za-z]', '', name)
+
+def profiles_fname(index):
+	""" File name of the host profiles, next to
+		the mouse features. """
+	return 'data/mouse_' + index + '_profiles'
+
+class HostProfiles():
+
+	def __init__(self, virus_knn, host_keys, H, df, k=5):
+		""" Virulence of every virus in the hosts with
+			known virulence, for scoring host strains
+			which are not in the graph.
+
+			Known virulence is kept, and the rest of
+			the profile of each host is filled in from
+			the k nearest viruses with known virulence
+			in that host, as in knn_virulence().
+
+			Parameters
+			----------
+			virus_knn: KNNIndex
+				Index over the virus embeddings.
+
+			host_keys: np.ndarray
+				Names of the hosts with mouse features.
+
+			H: np.ndarray
+				Mouse features of the hosts.
+
+			df: pd.DataFrame
+				Rows of 'influenza_strain', 'host_strain' and
+				'virulence_level', as in merged_bi.csv.
+
+			k: int
+				Number of labelled neighbours to average.
+		"""
+
+		df = df[df['influenza_strain'].isin(virus_knn.key_pos)]
+		host_pos = dict((h, i) for i, h in enumerate(host_keys))
+
+		self.viruses = virus_knn.keys
+		self.hosts = sorted(set(df['host_strain']) & set(host_pos))
+		self.embeddings = dict(zip(host_keys, H))
+
+		# Every (virus, host) pair, host major
+		rows = pd.DataFrame({
+			'influenza_strain': np.tile(self.viruses, len(self.hosts)),
+			'host_strain': np.repeat(self.hosts, len(self.viruses))})
+		est = knn_virulence(virus_knn, df, k, rows=rows)
+		est = est.reshape((len(self.hosts), len(self.viruses)))
+
+		known = df.pivot_table(index='host_strain',
+								columns='influenza_strain',
+								values='virulence_level',
+								aggfunc='mean')
+		known = known.reindex(index=self.hosts, columns=self.viruses)
+
+		# Profiles of shape (n_hosts, n_viruses)
+		self.P = np.where(np.isnan(known.values), est, known.values)
+
+		self.host_knn = KNNIndex(self.hosts,
+			np.vstack([H[host_pos[h]] for h in self.hosts]),
+			method='brute')
+
+	def predict(self, X, k_hosts=3):
+		""" Virulence of every virus in each new host,
+			averaged over the profiles of its k_hosts
+			nearest hosts weighted by inverse distance.
+
+			Parameters
+			----------
+			X: np.ndarray
+				Mouse features of the new hosts, of shape
+				(n_new, THRESHOLD).
+
+			Returns
+			-------
+			np.ndarray of shape (n_new, n_viruses), with
+			the viruses in the order of self.viruses.
+		"""
+		dist, ind = self.host_knn.query(X, k_hosts)
+		w = 1.0 / (dist + 1e-6)
+		w /= w.sum(axis=1)[:, None]
+
+		W = np.zeros((len(w), len(self.hosts)))
+		W[np.arange(len(w))[:, None], ind] = w
+
+		return W.dot(self.P)
+
+	def predict_names(self, names, k_hosts=3):
+		""" Predict for hosts which have mouse features
+			but no virulence, eg. 'ICR'. """
+		X = np.vstack([self.embeddings[host_key(n)] for n in names])
+		return self.predict(X, k_hosts)
+
+	def to_frame(self, names, est):
+		""" Predictions in the form of merged_bi.csv. """
+		return pd.DataFrame({
+			'influenza_strain': np.tile(self.viruses, len(names)),
+			'host_strain': np.repeat(names, len(self.viruses)),
+			'virulence_est': est.ravel()},
+			columns=['influenza_strain', 'host_strain', 'virulence_est'])
+
+	def save(self, fname):
+		""" Save the profiles to disc. """
+		with open(fname, 'w') as f:
+			pickle.dump(self, f)
+
+def load_unseen_hosts(fname='unseen_hosts.csv'):
+	""" Names of the host strains kept apart by
+		change_collected_mice.py, or none if it
+		has not been run. """
+	if not os.path.exists(fname):
+		return []
+
+	df = pd.read_csv(fname, index_col=0)
+	return sorted(set(df['Host_strain']))
+
+def empty_hosts(profiles, index='JOND920101'):
+	""" Hosts whose mouse features were all zeros
+		before reduction, eg. the placeholder proteomes
+		of ICR and SJL/JOrlCrl. They all share one
+		embedding, so nothing specific can be predicted
+		for them.
+	"""
+	state = load_fit_state('mouse', index)
+	if 'empty' in state:
+		return set(state['empty'])
+
+	# States saved before 'empty' was kept. The features
+	# are stored at a lower precision, so allow for it.
+	zeros = np.zeros((1, int(np.sum(state['nonzero']))))
+	z = state['reducer'].transform(zeros)[0]
+	H = np.vstack(profiles.embeddings.values())
+	tol = 1e-3 * np.abs(H).max()
+	return set([h for h, x in profiles.embeddings.items()
+				if np.abs(x - z).max() <= tol])
+
+def load_profiles(fname):
+	""" Load profiles saved by HostProfiles.save(). """
+	with open(fname) as f:
+		return pickle.load(f)
+
+def build_profiles(index='JOND920101',
+					levels=DATA_REPO + '/merged_bi.csv',
+					k=5, save=True):
+	""" Build the host profiles from the reduced
+		features of both particles. """
+	v_keys, V = load_embeddings(features_fname('virus', index))
+	h_keys, H = load_embeddings(features_fname('mouse', index))
+	df = pd.read_csv(levels, index_col=0)
+
+	profiles = HostProfiles(KNNIndex(v_keys, V), h_keys, H, df, k)
+	if save:
+		profiles.save(profiles_fname(index))
+
+	return profiles
+
+def main():
+	# Parser arguments
+	parser = argparse.ArgumentParser(
+		description='Predicts virulence in host strains ' + \
+					'which are not in the graph.')
+
+	parser.add_argument('-i', '--index', nargs='?',
+		default='JOND920101', type=str,
+		help="Index from AAindex used for the features.")
+	parser.add_argument('-l', '--levels', nargs='?',
+		default=DATA_REPO + '/merged_bi.csv', type=str,
+		help="merged_bi.csv or merged_tri.csv.")
+	parser.add_argument('-d', '--new_dir', nargs='?',
+		default=None, type=str,
+		help="Directory of preprocessed proteomes of new hosts.")
+	parser.add_argument('-n', '--names', nargs='*', default=[],
+		type=str, help="Hosts with mouse features but no virulence.")
+	parser.add_argument('-u', '--unseen', nargs='?',
+		default='unseen_hosts.csv', type=str,
+		help="Hosts kept apart by change_collected_mice.py.")
+	parser.add_argument('-k', nargs='?', default=5,
+		type=int, help="Labelled viruses used to fill profiles.")
+	parser.add_argument('-kh', '--k_hosts', nargs='?', default=3,
+		type=int, help="Hosts averaged for each new host.")
+	parser.add_argument('-o', '--out', nargs='?',
+		default='data/cold_start.csv', type=str,
+		help="File to save the predictions to.")
+
+	args = parser.parse_args()
+	profiles = build_profiles(args.index, args.levels, args.k)
+
+	# Hosts without mouse features, or with placeholder
+	# ones, cannot be placed
+	hosts = args.names + [h for h in load_unseen_hosts(args.unseen)
+						if h not in args.names]
+	missing = [h for h in hosts if host_key(h) not in profiles.embeddings]
+	if missing:
+		print "No mouse features for", missing
+	empty = empty_hosts(profiles, args.index)
+	placeholders = [h for h in hosts if host_key(h) in empty]
+	if placeholders:
+		print "All-zero mouse features for", placeholders, \
+			"- pass their proteomes with --new_dir."
+	hosts = [h for h in hosts 
+			if h not in missing and h not in placeholders]
+
+	names, est = [], []
+	if hosts:
+		names += hosts
+		est.append(profiles.predict_names(hosts, args.k_hosts))
+	if args.new_dir:
+		keys, _X, X_reduced = embed_strains(args.new_dir, 'mouse',
+											args.index)
+		names += keys
+		est.append(profiles.predict(X_reduced, args.k_hosts))
+
+	if not names:
+		print "Nothing to predict, pass --names, --unseen or --new_dir."
+		return
+
+	df = profiles.to_frame(names, np.vstack(est))
+	df.to_csv(args.out)
+	print "Saved", len(df), "predictions for", len(names), "hosts."
+
+if __name__ == "__main__":
+	main()
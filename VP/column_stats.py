@@ -0,0 +1,130 @@
+#!usr/bin/python
+
+import os
+import numpy as np
+
+from config import ALPHABET
+
+# Number of symbols in the alphabet and
+# the position of the gap in it.
+N_SYMBOLS = len(ALPHABET)
+GAP = ALPHABET.index('-')
+
+# Lookup table from a byte to its position in
+# ALPHABET. Characters outside it map to N_SYMBOLS.
+_LOOKUP = np.full(256, N_SYMBOLS, dtype=np.uint8)
+for _i, _c in enumerate(ALPHABET):
+	_LOOKUP[ord(_c)] = _i
+
+def stats_dir(particle):
+	""" Directory in which the column statistics
+		of the preprocessed alignments are stored.
+	"""
+	return 'data/' + particle + '_stats'
+
+def stats_path(fname, particle):
+	""" Path of the column statistics for the
+		preprocessed alignment fname.
+	"""
+	return stats_dir(particle) + '/' + fname.split('.')[0] + '.npy'
+
+def column_counts(df, extra=''):
+	""" Count the residues in every column of
+		an alignment.
+
+		Parameters
+		----------
+		df: pd.DataFrame
+			Alignment as returned by get_df_from_file(),
+			one residue per cell.
+
+		extra: str
+			Symbols outside ALPHABET to count as well,
+			eg. 'X' before the alignment is cleaned.
+
+		Returns
+		-------
+		counts: np.ndarray
+			Array of shape (n_columns, 21 + len(extra)) and
+			dtype uint32 where counts[i, j] is the number of
+			times (ALPHABET + extra)[j] occurs in column i.
+	"""
+	lookup = _LOOKUP.copy()
+	lookup[lookup == N_SYMBOLS] = N_SYMBOLS + len(extra)
+	for i, c in enumerate(extra):
+		lookup[ord(c)] = N_SYMBOLS + i
+	n_symbols = N_SYMBOLS + len(extra)
+
+	chars = np.asarray(df.values, dtype='S1').view(np.uint8)
+	codes = lookup[chars]
+
+	if (codes == n_symbols).any():
+		raise ValueError("Alignment has characters outside ALPHABET.")
+
+	n_cols = codes.shape[1]
+	flat = codes.astype(np.int64) + n_symbols * np.arange(n_cols)
+	counts = np.bincount(flat.ravel(), minlength=n_cols * n_symbols)
+
+	return counts.reshape((n_cols, n_symbols)).astype(np.uint32)
+
+def save_counts(counts, fname, particle):
+	""" Save the column statistics of an alignment. """
+	dirname = stats_dir(particle)
+	if not os.path.exists(dirname):
+		os.makedirs(dirname)
+
+	np.save(stats_path(fname, particle), counts)
+
+def load_counts(fname, particle, mmap=True):
+	""" Load the column statistics of an alignment.
+
+		If mmap is True, the counts are memory mapped
+		instead of being read into memory.
+	"""
+	mode = 'r' if mmap else None
+	return np.load(stats_path(fname, particle), mmap_mode=mode)
+
+def modes(counts, extra=''):
+	""" The most frequent residue of each column,
+		from counts of ALPHABET + extra. Ties go to
+		the first symbol in sorted order, as with
+		pd.Series.mode().
+	"""
+	symbols = np.array(list(ALPHABET + extra))
+	order = np.argsort(symbols, kind='mergesort')
+	return symbols[order][np.argmax(counts[:, order], axis=1)]
+
+def gap_rate(counts):
+	""" The fraction of gaps in each column. """
+	totals = counts.sum(axis=1).astype(np.float64)
+	return counts[:, GAP] / np.maximum(totals, 1.0)
+
+def entropy(counts):
+	""" Shannon entropy (in bits) of the residues in
+		each column. Gaps are not counted, so a column
+		which only has gaps has an entropy of 0.0.
+	"""
+	res = np.delete(counts, GAP, axis=1).astype(np.float64)
+	totals = res.sum(axis=1, keepdims=True)
+	p = res / np.maximum(totals, 1.0)
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		logs = np.where(p > 0, np.log2(p), 0.0)
+
+	return -(p * logs).sum(axis=1)
+
+def informative_columns(counts, min_entropy=None, max_gap=None):
+	""" Mask of the columns worth keeping as features.
+
+		Columns which are conserved (entropy not above
+		min_entropy) or mostly gaps (gap rate above
+		max_gap) carry little information for the
+		reduction and are masked out. A threshold
+		which is None is not applied.
+	"""
+	mask = np.ones(len(counts), dtype=bool)
+	if min_entropy is not None:
+		mask &= entropy(counts) > min_entropy
+	if max_gap is not None:
+		mask &= gap_rate(counts) <= max_gap
+	return mask
@@ -3,10 +3,24 @@
 # Parameters
 THRESHOLD = 12
 DATA_REPO = '/home/vedang/Documents/revised_data'
+CACHE_DIR = 'data/cache'
+CACHE_SIZE = 2 ** 30
+SHARED_DIR = 'data/shared'
+CHECKPOINT_DIR = 'data/checkpoints'
+
+# Precision of the encodings, padding and the input of
+# the reducer, and of the saved reduced features.
+# STORAGE_PRECISION can be 'float16' to halve the files.
+PRECISION = 'float32'
+STORAGE_PRECISION = 'float32'
 
 # Constants
 AMINO_ACIDS = frozenset(['G', 'P', 'A', 'V', 'L', 
 						 'I', 'M', 'C', 'F', 'Y', 
 						 'W', 'H', 'K', 'R', 'Q', 
 						 'N', 'E', 'D', 'S', 'T', 
-						 '-'])
\ No newline at end of file
+						 '-'])
+
+# Ordered residue alphabet used for column statistics.
+# The gap, '-', is always the last symbol.
+ALPHABET = 'GPAVLIMCFYWHKRQNEDST-'
\ No newline at end of file
@@ -0,0 +1,265 @@
+#!usr/bin/python
+
+import os
+import click
+import numpy as np
+import scipy.sparse as sp
+
+import features
+from config import ALPHABET, PRECISION
+from features import _change_format_ids
+from reduce_dimension import reduce_dimension, reduce_sparse
+from incremental import save_fit_state, load_fit_state, \
+						add_strain_names, _register, _update_features
+from quantiprot.utils.io import load_fasta_file
+
+# The 20 amino acids, without the gap
+RESIDUES = ALPHABET.replace('-', '')
+N_RESIDUES = len(RESIDUES)
+
+# Lookup table from a byte to its position in RESIDUES.
+# Anything else (gaps, 'X', terminal '*') maps to -1 and
+# no k-mer is counted across it.
+_CODES = np.full(256, -1, dtype=np.int64)
+for _i, _c in enumerate(RESIDUES):
+	_CODES[ord(_c)] = _i
+
+# Multiplier for hashing k-mers into n_features bins
+_HASH = 2654435761
+
+def kmer_ids(seq, k):
+	""" Ids of all k-mers of a sequence, computed
+		with sliding windows over the residue codes.
+		The id of a k-mer is its value in base 20.
+
+		Parameters
+		----------
+		seq: str
+			Protein sequence.
+
+		k: int
+			Length of the k-mers.
+	"""
+	codes = _CODES[np.frombuffer(seq, dtype=np.uint8)]
+	n = len(codes) - k + 1
+	if n <= 0:
+		return np.zeros((0,), dtype=np.int64)
+
+	ids = np.zeros((n,), dtype=np.int64)
+	bad = np.zeros((n,), dtype=bool)
+	for j in range(k):
+		window = codes[j:j + n]
+		ids = ids * N_RESIDUES + window
+		bad |= window < 0
+
+	return ids[~bad]
+
+class EmbeddingsByKmers():
+
+	def __init__(self, particle, k=3,
+				n_features=4096, reducer='svd',
+				save=True):
+		""" Class to convert proteomes to hashed k-mer
+			count embeddings. No alignment is needed,
+			so new strains can skip MUSCLE (see
+			transform() and append()).
+
+			With the 'svd' reducer the counts stay
+			sparse throughout. """
+
+		self.particle = particle
+		self.k = k
+		self.n_features = n_features
+		self.reducer = reducer
+		self.save = save
+		self.name = 'kmer' + str(k)
+
+	def __call__(self, seq_dir):
+		""" Convert a directory of (unaligned) fasta
+			files to features. """
+
+		print
+		print "Counting k-mers ->"
+		X, keys = self.count(seq_dir)
+		print "Shape of counts =", X.shape
+		print "Done."
+
+		print
+
+		print "Reducing dimension ->"
+		keys, X = self._reduce(X, keys)
+		print "Done."
+
+		return keys, X
+
+	def _columns(self, seq):
+		""" Feature columns and values of one sequence. """
+		ids = kmer_ids(seq, self.k)
+		if N_RESIDUES ** self.k > self.n_features:
+			ids = (ids * _HASH) % (2 ** 32) % self.n_features
+
+		return ids, np.ones(ids.shape)
+
+	def _width(self):
+		""" Number of feature columns. """
+		return min(N_RESIDUES ** self.k, self.n_features)
+
+	def _normalise(self, X):
+		""" Scale the summed counts of each strain. """
+		return X
+
+	def count(self, seq_dir, registered=True):
+		""" Count the k-mers of every strain into a
+			sparse matrix. The sequences of a strain
+			can be spread over any number of files.
+
+			If registered is True, the rows are the
+			strains in the orders registry and any other
+			strain is skipped. Otherwise the rows are
+			the strains found in seq_dir.
+
+			Returns the CSR matrix and the names of
+			its rows.
+		"""
+		pos = {}
+		if registered:
+			if self.particle == 'virus':
+				keys = sorted(features.ids_set_virus)
+			else:
+				keys = sorted(features.ids_set_mouse)
+			pos = dict((key, i) for i, key in enumerate(keys))
+
+		# Stream each file into COO chunks
+		rows, cols, vals = [], [], []
+		with click.progressbar(os.listdir(seq_dir)) as bar:
+			for fname in bar:
+				f = load_fasta_file(seq_dir + '/' + fname)
+				seqs = [f[i] for i in range(len(f))]
+				ids = _change_format_ids([s.identifier for s in seqs],
+										self.particle)
+
+				for seq, seq_id in zip(seqs, ids):
+					if seq_id not in pos:
+						if registered:
+							print "Couldn't preprocess", seq_id
+							continue
+						pos[seq_id] = len(pos)
+					c, v = self._columns(''.join(seq.data))
+					rows.append(np.full(c.shape, pos[seq_id],
+										dtype=np.int64))
+					cols.append(c)
+					vals.append(v)
+
+		keys = sorted(pos, key=pos.get)
+
+		# Duplicates are summed
+		X = sp.coo_matrix((np.concatenate(vals),
+						(np.concatenate(rows), np.concatenate(cols))),
+						shape=(len(keys), self._width()))
+
+		return self._normalise(X.tocsr()).astype(PRECISION), keys
+
+	def _reduce(self, X, keys):
+		""" Reduce the dimension and save like the
+			AAindex features, as data/<particle>_<name>,
+			along with the state needed by transform().
+		"""
+		state = {}
+		if self.reducer == 'svd':
+			keys, X = reduce_sparse(keys, X, self.particle,
+				self.name, self.save, state)
+		else:
+			features = dict((key, [X[i].toarray().ravel()]) 
+							for i, key in enumerate(keys))
+			keys, X = reduce_dimension(features, self.particle,
+				self.name, self.reducer, self.save, state)
+
+		if self.save:
+			save_fit_state(state, self.particle, self.name)
+
+		return keys, X
+
+	def transform(self, seq_dir, strain_names=None):
+		""" Embed the strains in a directory of
+			unaligned fasta files with the reducer of
+			the last run. The strains need not be in the
+			orders registry, and nothing is saved.
+
+			strain_names are the names of new viruses
+			by Type-num, as in incremental.append_strains().
+
+			Returns the names and the reduced features.
+		"""
+		state = load_fit_state(self.particle, self.name)
+		if state['fit_error'] is None:
+			raise ValueError("The reducer of the last full run " + \
+							"cannot transform new strains.")
+		add_strain_names(strain_names, save=False)
+
+		X, keys = self.count(seq_dir, registered=False)
+		if state['nonzero'] is not None:
+			X = X[:, np.flatnonzero(state['nonzero'])].toarray()
+
+		return keys, state['reducer'].transform(X)
+
+	def append(self, seq_dir, strain_names=None):
+		""" Add the strains of seq_dir to the orders
+			registry and the saved features, using
+			transform(). """
+		keys, X_reduced = self.transform(seq_dir, strain_names)
+
+		add_strain_names(strain_names)
+		_register(keys, self.particle)
+		_update_features(keys, X_reduced, self.particle, self.name)
+
+		return keys, X_reduced
+
+class EmbeddingsByComposition(EmbeddingsByKmers):
+
+	def __init__(self, particle, dipeptides=True,
+				reducer='svd', save=True):
+		""" Class to convert proteomes to amino acid
+			composition (and dipeptide composition)
+			embeddings. No alignment is needed. """
+
+		EmbeddingsByKmers.__init__(self, particle, k=1,
+			n_features=N_RESIDUES, reducer=reducer, save=save)
+
+		self.dipeptides = dipeptides
+		self.name = 'comp' + ('2' if dipeptides else '1')
+
+	def _columns(self, seq):
+		""" Residue counts followed by the dipeptide
+			counts of one sequence. """
+		ids = kmer_ids(seq, 1)
+		c = [ids]
+
+		if self.dipeptides:
+			c.append(kmer_ids(seq, 2) + N_RESIDUES)
+
+		c = np.concatenate(c)
+		return c, np.ones(c.shape)
+
+	def _width(self):
+		""" Number of feature columns. """
+		if self.dipeptides:
+			return N_RESIDUES + N_RESIDUES ** 2
+		return N_RESIDUES
+
+	def _normalise(self, X):
+		""" Turn the counts of each strain, summed over
+			all its sequences, into frequencies within
+			the residue and the dipeptide blocks, so
+			they do not grow with the number of
+			segments. """
+		X = X.astype(np.float64)
+		rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+		block = (X.indices >= N_RESIDUES).astype(np.int64)
+
+		# Totals of each (strain, block)
+		cell = rows * 2 + block
+		totals = np.bincount(cell, weights=X.data, 
+							minlength=2 * X.shape[0])
+		X.data /= totals[cell]
+
+		return X
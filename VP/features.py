@@ -1,16 +1,25 @@
 #!usr/bin/python
 
 import os
+import re
 import sys
 import click
 import pickle
 import argparse
+import itertools
+import traceback
 import numpy as np
+import pandas as pd
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import warnings
 warnings.filterwarnings("ignore")
 
-from config import DATA_REPO
+from config import DATA_REPO, PRECISION
+from checkpoint import Journal
+from column_stats import load_counts, informative_columns
+from alignment_store import is_store, AlignmentStore
 from keras.preprocessing.sequence import pad_sequences
 
 from quantiprot.utils.io import load_fasta_file
@@ -28,6 +37,14 @@ with open(DATA_REPO + '/orders') as f:
 with open(DATA_REPO + '/viruses_dict') as f:
 	viruses_dict = pickle.load(f)
 
+# Strain field of a virus identifier,
+# eg. 'ASSEM0004' in 'tr|ASSEM0004_AF046093p1_...'
+_VIRUS_STRAIN_RE = re.compile(r'^[^|]*\|([^|_]*)')
+
+# Memoised outputs of _change_format_virus()
+# and _change_format_mouse()
+_IDEN_CACHE = {'virus': {}, 'mouse': {}}
+
 def _change_format_virus(iden):
 	""" Remove the Seq-ID from the identifier
 		of any sequence.
@@ -35,31 +52,58 @@ def _change_format_virus(iden):
 		For more info about Seq-ID, refer to 
 		virus_doc.md in VirulencePredictor/docs.
 	"""
-	iden = iden.split('|')[1]
-	iden = iden.split('_')
-	strain = iden[0]
+	cache = _IDEN_CACHE['virus']
+	if iden in cache:
+		return cache[iden]
 
-	return viruses_dict[strain]
+	strain = iden.split('|')[1]
+	strain = strain.partition('_')[0]
+
+	cache[iden] = viruses_dict[strain]
+	return cache[iden]
 
 def _change_format_mouse(iden):
 	""" Remove the Seq-ID from the identifier
 		of any sequence.
 	"""
+	cache = _IDEN_CACHE['mouse']
+	if iden in cache:
+		return cache[iden]
+
+	parts = iden.split('_')
+	if len(parts) == 2:
+		# Drop the 5 character suffix of the strain
+		cache[iden] = parts[1][:-5]
+	else:
+		cache[iden] = parts[1]
 
-	iden = iden.split('_')
+	return cache[iden]
 
-	if len(iden) == 3:
-		iden.pop()
-	elif len(iden) == 2:
-		l = list(iden[1])
-		for i in range(5):
-			l.pop()
-		iden[1] = ''.join(l)
+def _change_format_ids(idens, particle):
+	""" Vectorised _change_format_virus() or
+		_change_format_mouse() over a batch of
+		identifiers.
+
+		Returns a list of the formatted identifiers,
+		in order.
+	"""
+	idens = pd.Series(idens, dtype=object)
+
+	if particle == 'virus':
+		strains = idens.str.extract(_VIRUS_STRAIN_RE, expand=False)
+		ids = strains.map(viruses_dict)
 
-	iden.pop(0)
-	iden = iden[0]
+		# Same failure as _change_format_virus()
+		missing = ids.isnull()
+		if missing.any():
+			raise KeyError(strains[missing].iloc[0])
+	else:
+		parts = idens.str.split('_')
+		ids = parts.str[1]
+		two = parts.str.len() == 2
+		ids[two] = ids[two].str[:-5]
 
-	return iden
+	return ids.tolist()
 
 def _get_feature_map(index='JOND920101'):
 	""" To get the feature mapping object 
@@ -76,6 +120,39 @@ def _get_feature_map(index='JOND920101'):
 	
 	return feat_map
 
+# Memoised lookup tables of _get_lookup()
+_LOOKUPS = {}
+
+def _get_lookup(index='JOND920101'):
+	""" A table of the AAindex values indexed by
+		the byte value of each residue, so that
+		whole sequences are encoded at once.
+		Residues which are not in the index map
+		to NaN.
+	"""
+	if index not in _LOOKUPS:
+		mapping = _get_feature_map(index).function.mapping
+		lookup = np.full(256, np.nan, dtype=PRECISION)
+		for res, val in mapping.items():
+			if len(res) == 1:
+				lookup[ord(res)] = val
+		_LOOKUPS[index] = lookup
+
+	return _LOOKUPS[index]
+
+def _encode_seq(seq, lookup):
+	""" Encode a sequence using a table from
+		_get_lookup().
+	"""
+	chars = np.frombuffer(''.join(seq.data), dtype=np.uint8)
+	vals = lookup[chars]
+
+	if np.isnan(vals).any():
+		err = "Residues not in AAindex in " + seq.identifier
+		raise ValueError(err)
+
+	return vals
+
 def _pad_encoding(enc, pad_len):
 	""" A function to pad all the values in a 
 		dictionary.
@@ -85,7 +162,7 @@ def _pad_encoding(enc, pad_len):
 		val = np.reshape(val, (1, len(val)))
 		val = pad_sequences(val, 
 							maxlen=pad_len, 
-							dtype='float32', 
+							dtype=PRECISION, 
 							padding='pre', 
 							truncating='pre', 
 							value=0.0)
@@ -93,34 +170,54 @@ def _pad_encoding(enc, pad_len):
 		
 	return enc
 
-def encoded_seq_from_file(fname, dirname, particle, index):
+def encoded_seq_from_file(fname, dirname, particle, index, 
+						col_mask=None):
 	""" Function to encode the sequences from
 		a file using AAindex. The encoded sequences
 		are then padded to maximum length.
+
+		If col_mask is given, only the alignment
+		columns where it is True are kept.
+
+		Both fasta files and binary alignments
+		(see alignment_store.py) can be read.
 	"""
 
-	# Load the fasta file
-	f = load_fasta_file(dirname + '/' + fname)
-	feat_map = _get_feature_map(index)
+	lookup = _get_lookup(index)
+	fpath = dirname + '/' + fname
+
+	if is_store(fname):
+		# Encode the whole binary alignment at once
+		store = AlignmentStore(fpath)
+		idens = store.ids
+		vals = store.encode(lookup)
+
+		if np.isnan(vals).any():
+			err = "Residues not in AAindex in " + fpath
+			raise ValueError(err)
+	else:
+		# Load the fasta file
+		f = load_fasta_file(fpath)
 	
-	# Get the sequences in a dataset
-	dataset = []
-	for i in range(len(f)):
-		dataset.append(f[i])
+		# Get the sequences in a dataset
+		dataset = []
+		for i in range(len(f)):
+			dataset.append(f[i])
+
+		idens = [seq.identifier for seq in dataset]
+		vals = [_encode_seq(seq, lookup) for seq in dataset]
 		
 	# Create a dictionary with keys as identifiers
 	# and their values as the data.
+	ids = _change_format_ids(idens, particle)
+
 	enc = {}
-	if particle == 'virus':
-		for seq in dataset:
-			seq_id = _change_format_virus(seq.identifier)
-			enc[seq_id] = feat_map(seq).data
-	elif particle == 'mouse':
-		for seq in dataset:
-			seq_id = _change_format_mouse(seq.identifier)
-			if seq_id not in ids_set_mouse:
-				print seq.identifier, seq_id
-			enc[seq_id] = feat_map(seq).data
+	for iden, seq_id, val in zip(idens, ids, vals):
+		if particle == 'mouse' and seq_id not in ids_set_mouse:
+			print iden, seq_id
+		enc[seq_id] = val
+		if col_mask is not None:
+			enc[seq_id] = enc[seq_id][col_mask]
 	
 	# Pad all sequences to maximum value in the
 	# dataset.
@@ -148,10 +245,10 @@ def pad_dict(enc, max_len, particle):
 	fill_dict = {}
 	if particle == 'virus':
 		for k in ids_set_virus - set(enc.keys()):
-			fill_dict[k] = np.zeros((fill_len,))
+			fill_dict[k] = np.zeros((fill_len,), dtype=PRECISION)
 	elif particle == 'mouse':
 		for k in ids_set_mouse - set(enc.keys()):
-			fill_dict[k] = np.zeros((fill_len,))
+			fill_dict[k] = np.zeros((fill_len,), dtype=PRECISION)
 		
 	# Add the created dictionary to the pre-existing dictionary
 	enc.update(fill_dict)
@@ -161,7 +258,7 @@ def pad_dict(enc, max_len, particle):
 		val = enc[k]
 		val = np.reshape(val, (1, len(val)))
 		val = pad_sequences(val, maxlen=max_len,
-						dtype='float32', padding='pre', truncating='pre', value=0.0)
+						dtype=PRECISION, padding='pre', truncating='pre', value=0.0)
 		enc[k] = val[0]
 
 	return enc
@@ -205,24 +302,185 @@ def recombine(encs, particle):
 
 	return features_dict
 
-def extract_features(particle, index):
-	""" Function to extract features from the 
-		preprocessed files.
+def _encode_job(args):
+	""" Encode one file for the pool in _extract_pooled().
+		Returns the identifiers and their encodings
+		stacked in one array, or None and the error
+		if the file failed.
 	"""
+	j, fname, read_dir, particle, index, mask = args
+	try:
+		enc = encoded_seq_from_file(fname, read_dir, 
+									particle, index, mask)
+	except Exception as e:
+		return j, None, (e, traceback.format_exc())
+	keys = enc.keys()
+	block = np.vstack([enc[k] for k in keys]).astype(PRECISION)
+	
+	return j, keys, block
 
-	# Get encodings from AAindex
-	encs = []
-	print "Encoding using AAindex..."
-
+def _file_width(fname, particle, mask):
+	""" Width of the encodings of a preprocessed file,
+		from the column statistics if they exist.
+	"""
+	if mask is not None:
+		return int(mask.sum())
+	try:
+		return len(load_counts(fname, particle))
+	except IOError:
+		return None
+
+def _write_block(tensor, j, rows, block):
+	""" Pad (or truncate) the encodings of file j at 
+		the front, as pad_sequences() does, and write 
+		them to the rows of the feature tensor.
+	"""
+	max_len = tensor.shape[2]
+	block = block[:, -max_len:]
+	tensor[rows, j, max_len - block.shape[1]:] = block
+
+def _extract_pooled(fnames, masks, read_dir, particle, index,
+					workers, executor, journal=None):
+	""" Encode the files concurrently and write each 
+		result into the feature tensor as it completes.
+
+		Files finished by an earlier run are read from
+		the journal, and files which fail are
+		quarantined in it.
+
+		Returns the features, with the same layout as
+		recombine(), the padding length and the files
+		used.
+	"""
 	if particle == 'virus':
-		read_dir = 'data/virus'
+		ids = sorted(ids_set_virus)
 	else:
-		read_dir = 'data/mouse'
+		ids = sorted(ids_set_mouse)
+	pos = dict((k, i) for i, k in enumerate(ids))
+
+	jobs, cached = [], []
+	for j, fname in enumerate(fnames):
+		path = read_dir + '/' + fname
+		if journal is not None and journal.is_done(path):
+			keys, block = journal.result(path)
+			cached.append((j, keys, block))
+		else:
+			jobs.append((j, fname, read_dir, particle, index, 
+						masks[fname]))
+	resumed = set([j for j, _k, _b in cached])
+
+	# If all widths are known, the tensor can be
+	# allocated before any file is encoded.
+	widths = [_file_width(fname, particle, masks[fname])
+				for fname in fnames]
+	tensor, pending = None, []
+	if None not in widths:
+		tensor = np.zeros((len(ids), len(fnames), max(widths)),
+							dtype=PRECISION)
+
+	if executor == 'process':
+		pool = multiprocessing.Pool(workers)
+	else:
+		pool = ThreadPool(workers)
+
+	results = itertools.chain(cached, 
+		pool.imap_unordered(_encode_job, jobs))
+	failed = set()
+	with click.progressbar(results, length=len(fnames)) as bar:
+		for j, keys, block in bar:
+			path = read_dir + '/' + fnames[j]
+			if keys is None:
+				if journal is None:
+					raise block[0]
+				journal.fail(path, block[0], block[1])
+				failed.add(j)
+				continue
+			if journal is not None and j not in resumed:
+				journal.done(path, result=(keys, block))
+
+			known = [i for i, k in enumerate(keys) if k in pos]
+			for i in set(range(len(keys))) - set(known):
+				print "Couldn't preprocess", keys[i]
+
+			rows = [pos[keys[i]] for i in known]
+			if tensor is None:
+				pending.append((j, rows, block[known]))
+			else:
+				_write_block(tensor, j, rows, block[known])
+
+	pool.close()
+	pool.join()
+
+	if len(failed) == len(fnames):
+		raise ValueError("No file could be encoded.")
+
+	if tensor is None:
+		max_len = max([block.shape[1] for _j, _r, block in pending])
+		tensor = np.zeros((len(ids), len(fnames), max_len),
+							dtype=PRECISION)
+		for j, rows, block in pending:
+			_write_block(tensor, j, rows, block)
+
+	# Drop the segments of quarantined files
+	if failed:
+		keep = [j for j in range(len(fnames)) if j not in failed]
+		tensor = tensor[:, keep]
+		fnames = [fnames[j] for j in keep]
+
+	features = dict((k, tensor[i]) for i, k in enumerate(ids))
+
+	return features, tensor.shape[2], fnames
+
+def _encode_file(fname, read_dir, particle, index, mask, 
+				journal=None):
+	""" Encode one file, or read its encodings from
+		the journal of an earlier run. Returns None
+		if the file failed and was quarantined.
+	"""
+	if journal is None:
+		return encoded_seq_from_file(fname, read_dir, 
+									particle, index, mask)
+
+	path = read_dir + '/' + fname
+	if journal.is_done(path):
+		keys, block = journal.result(path)
+		return dict(zip(keys, block))
+
+	try:
+		enc = encoded_seq_from_file(fname, read_dir, 
+									particle, index, mask)
+	except Exception as e:
+		journal.fail(path, e)
+		return None
+
+	keys = enc.keys()
+	journal.done(path, result=(keys, np.vstack([enc[k] for k in keys])))
+
+	return enc
+
+def _extract_serial(fnames, masks, read_dir, particle, index,
+					journal=None):
+	""" Encode the files one by one, then pad and
+		recombine them.
+
+		Returns the features, the padding length and
+		the files used.
+	"""
+
+	# Get encodings from AAindex
+	encs, used = [], []
+	print "Encoding using AAindex..."
 
-	with click.progressbar(os.listdir(read_dir)) as bar:
+	with click.progressbar(fnames) as bar:
 		for fname in bar:
-			encs.append(encoded_seq_from_file(fname, 
-				read_dir, particle, index))
+			enc = _encode_file(fname, read_dir, particle, 
+							index, masks[fname], journal)
+			if enc is not None:
+				encs.append(enc)
+				used.append(fname)
+
+	if not encs:
+		raise ValueError("No file could be encoded.")
 
 	# Length of the longest sequence
 	global_max_len = max([len(enc.values()[0]) for enc in encs])
@@ -239,4 +497,89 @@ def extract_features(particle, index):
 	print "Recombining features..."
 	features = recombine(encs, particle)
 
-	return features
\ No newline at end of file
+	return features, global_max_len, used
+
+def _column_mask(fname, particle, min_entropy, max_gap):
+	""" Mask of informative columns for a preprocessed
+		file, from the column statistics stored by
+		preprocess_alignments(). None if no filter is set.
+	"""
+	if min_entropy is None and max_gap is None:
+		return None
+
+	counts = load_counts(fname, particle)
+	return informative_columns(counts, min_entropy, max_gap)
+
+def extract_features(particle, index, min_entropy=None, max_gap=None,
+					state=None, workers=1, executor='thread',
+					restart=False, fmt='fasta'):
+	""" Function to extract features from the 
+		preprocessed files.
+
+		With more than one worker, the files are 
+		encoded concurrently by a pool of threads
+		(or processes if executor is 'process').
+
+		Setting min_entropy and/or max_gap drops
+		conserved or gap-heavy alignment columns (see
+		column_stats.informative_columns()) before
+		encoding, to shrink the feature width.
+
+		If a dictionary is passed as state, the file
+		order, column masks, alignment widths and
+		padding length used
+		are stored in it so that new strains can be
+		encoded the same way later (see incremental.py).
+
+		The encodings of each file are recorded in a
+		journal (see checkpoint.py), so a rerun after
+		a crash only encodes the remaining files. Files
+		which fail are quarantined and left out. Set
+		restart to True to encode every file again.
+
+		Only files in the format written by
+		preprocess_alignments() (fmt) are encoded.
+	"""
+
+	if particle == 'virus':
+		read_dir = 'data/virus'
+	else:
+		read_dir = 'data/mouse'
+
+	# Files of the active format
+	fnames = [fname for fname in os.listdir(read_dir)
+				if is_store(fname) == (fmt == 'binary')]
+	masks = {}
+	for fname in fnames:
+		masks[fname] = _column_mask(fname, particle, 
+			min_entropy, max_gap)
+
+	journal = Journal('extract_' + particle + '_' + index,
+		{'min_entropy': min_entropy, 'max_gap': max_gap, 'fmt': fmt},
+		restart)
+
+	if workers > 1:
+		print "Encoding using AAindex with", workers, executor + "s..."
+		features, global_max_len, used = _extract_pooled(fnames, 
+			masks, read_dir, particle, index, workers, executor, 
+			journal)
+	else:
+		features, global_max_len, used = _extract_serial(fnames, 
+			masks, read_dir, particle, index, journal)
+
+	# Report the quarantined files
+	quarantined = journal.quarantined()
+	failed = sorted(set(fnames) - set(used))
+	for fname in failed:
+		print "Quarantined", fname + ":", \
+			quarantined[read_dir + '/' + fname]
+
+	if state is not None:
+		state['files'] = used
+		state['quarantined'] = failed
+		state['col_masks'] = masks
+		state['widths'] = dict((fname, _file_width(fname, particle, None))
+							for fname in used)
+		state['global_max_len'] = global_max_len
+
+	return features
@@ -8,13 +8,19 @@ import numpy as np
 from features import *
 from reduce_dimension import *
 from preprocess_align import *
+from cache import EmbeddingCache
+from incremental import save_fit_state
+from embeddings import EmbeddingsByKmers, EmbeddingsByComposition
 
 class EmbeddingsByAAindex():
 
 	def __init__(self, particle,
 				index, preprocess=True,
 				reducer='ipca',
-				overwrite=False, save=True):
+				overwrite=False, save=True,
+				min_entropy=None, max_gap=None,
+				workers=1, executor='thread',
+				fmt='fasta', cache=True, restart=False):
 		""" Class to convert proteomes to AAindex embeddings. """
 
 		self.particle = particle
@@ -23,6 +29,13 @@ class EmbeddingsByAAindex():
 		self.reducer = reducer
 		self.overwrite = overwrite
 		self.save = save
+		self.min_entropy = min_entropy
+		self.max_gap = max_gap
+		self.workers = workers
+		self.executor = executor
+		self.fmt = fmt
+		self.cache = EmbeddingCache() if cache else None
+		self.restart = restart
 
 	def __call__(self, aligned_dir):
 		""" Convert directory containing 
@@ -31,31 +44,85 @@ class EmbeddingsByAAindex():
 		self.aligned_dir = aligned_dir
 		print
 
+		# Return cached features if nothing has changed,
+		# unless the run is restarted from scratch
+		if self.cache is not None and not self.restart:
+			key = self._cache_key()
+			cached = self.cache.get(key)
+			if cached is not None:
+				print "Using cached features."
+				keys, X, state = cached
+				if self.save:
+					save_reduced(keys, X, self.particle, self.index)
+					save_fit_state(state, self.particle, self.index)
+				return keys, X
+
+		quarantined = {}
 		if self.preprocess:
 			print "Preprocessing data ->"
-			preprocess_alignments(self.aligned_dir, 
-									self.overwrite, 
-									self.particle)
+			quarantined = preprocess_alignments(self.aligned_dir, 
+												self.overwrite, 
+												self.particle,
+												self.fmt,
+												self.restart)
 			print "Done."
 			print
 			
-		self._extract_and_reduce()
+		keys, X, state = self._extract_and_reduce()
+
+		# Features without quarantined files are not final
+		if self.cache is not None and not quarantined and \
+			not state['quarantined']:
+			self.cache.put(self._cache_key(), (keys, X, state))
+
+		return keys, X
+
+	def _cache_key(self):
+		""" Key of the features in the cache. """
+		if self.preprocess:
+			input_dir = self.aligned_dir
+		else:
+			input_dir = 'data/' + self.particle
+
+		return self.cache.key(input_dir,
+							backend='aaindex',
+							preprocess=self.preprocess,
+							particle=self.particle,
+							index=self.index,
+							reducer=self.reducer,
+							min_entropy=self.min_entropy,
+							max_gap=self.max_gap,
+							fmt=self.fmt)
 
 	def _extract_and_reduce(self,):
 		# Extract features from preprocessed data
 		print "Extracting features ->"
+		state = {}
 		features = extract_features(self.particle, 
-									self.index)
+									self.index,
+									self.min_entropy,
+									self.max_gap,
+									state,
+									self.workers,
+									self.executor,
+									self.restart,
+									self.fmt)
 		print "Done."
 
 		print 
 
 		# Reduce dimension by IPCA
 		print "Reducing dimension ->"
-		reduce_dimension(features, self.particle, 
-			self.index, self.reducer, self.save)
+		keys, X = reduce_dimension(features, self.particle, 
+			self.index, self.reducer, self.save, state)
 		print "Done."
 
+		# Keep what is needed to append strains later
+		if self.save:
+			save_fit_state(state, self.particle, self.index)
+
+		return keys, X, state
+
 
 # Parser arguments
 parser = argparse.ArgumentParser(
@@ -69,14 +136,52 @@ parser.add_argument('-p', '--particle', nargs='?',
 					choices=['virus', 'mouse'], type=str, 
 					help="'mouse' or 'virus'")
 
+parser.add_argument('-b', '--backend', nargs='?', 
+					choices=['aaindex', 'kmer', 'composition'], 
+					default='aaindex', type=str, 
+					help="Embedding to use. 'kmer' and 'composition' " + \
+						"read unaligned sequences from aligned_dir.")
+
+parser.add_argument('-k', nargs='?', 
+					default=3, type=int, 
+					help="Length of k-mers for the 'kmer' backend.")
+
+parser.add_argument('-nf', '--n_features', nargs='?', 
+					default=4096, type=int, 
+					help="Hashed features for the 'kmer' backend.")
+
 parser.add_argument('-i', '--index', nargs='?', 
 					default='JOND920101', type=str, 
 					help="Index from AAindex to use")
 
 parser.add_argument('-rm', '--reduction_method', nargs='?', 
-					choices=['ipca', 'pca', 't-sne'], 
-					default='ipca', type=str, 
-					help="Reduction method to use.")
+					choices=['ipca', 'pca', 'svd', 't-sne'], 
+					default=None, type=str, 
+					help="Reduction method to use, 'ipca' for " + \
+						"AAindex and 'svd' for the other backends " + \
+						"by default.")
+
+parser.add_argument('-me', '--min_entropy', nargs='?', 
+					default=None, type=float, 
+					help="Drop columns with entropy not above this.")
+
+parser.add_argument('-mg', '--max_gap', nargs='?', 
+					default=None, type=float, 
+					help="Drop columns with gap rate above this.")
+
+parser.add_argument('-w', '--workers', nargs='?', 
+					default=1, type=int, 
+					help="Number of workers encoding files.")
+
+parser.add_argument('-ex', '--executor', nargs='?', 
+					choices=['thread', 'process'], 
+					default='thread', type=str, 
+					help="Pool used when workers > 1.")
+
+parser.add_argument('-f', '--format', nargs='?', 
+					choices=['fasta', 'binary'], 
+					default='fasta', type=str, 
+					help="Format of the preprocessed alignments.")
 
 parser.add_argument('-s', '--save', 
 					help="Set true to save features",
@@ -86,17 +191,43 @@ parser.add_argument('-pr', '--preprocess',
 					help="Set True to preprocess", 
 					action='store_true')
 
+parser.add_argument('-nc', '--no_cache',
+					help="Set True to ignore the feature cache", 
+					action='store_true')
+
 parser.add_argument('-ow', '--overwrite',
 					help="Set True to overwrite", 
 					action='store_true')
 
+parser.add_argument('-r', '--restart',
+					help="Set True to ignore checkpoints of earlier runs", 
+					action='store_true')
+
 args = parser.parse_args()
 
-emb_aaindex = EmbeddingsByAAindex(particle=args.particle,
-								index=args.index,
-								preprocess=args.preprocess,
-								overwrite=args.overwrite,
-								reducer=args.reduction_method,
+if args.backend == 'kmer':
+	emb = EmbeddingsByKmers(particle=args.particle,
+							k=args.k,
+							n_features=args.n_features,
+							reducer=args.reduction_method or 'svd',
+							save=args.save)
+elif args.backend == 'composition':
+	emb = EmbeddingsByComposition(particle=args.particle,
+								reducer=args.reduction_method or 'svd',
 								save=args.save)
-
-emb_aaindex(args.aligned_dir)
\ No newline at end of file
+else:
+	emb = EmbeddingsByAAindex(particle=args.particle,
+							index=args.index,
+							preprocess=args.preprocess,
+							overwrite=args.overwrite,
+							reducer=args.reduction_method or 'ipca',
+							save=args.save,
+							min_entropy=args.min_entropy,
+							max_gap=args.max_gap,
+							workers=args.workers,
+							executor=args.executor,
+							fmt=args.format,
+							cache=not args.no_cache,
+							restart=args.restart)
+
+emb(args.aligned_dir)
\ No newline at end of file
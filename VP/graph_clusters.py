@@ -0,0 +1,298 @@
+#!usr/bin/python
+
+import argparse
+import numpy as np
+import scipy.sparse as sp
+
+from scipy.sparse.csgraph import connected_components
+
+# Largest difference between the test fraction of
+# cluster_split() and test_size before warning.
+SPLIT_TOLERANCE = 0.05
+
+def load_edges(fname='data/edges.txt'):
+	""" Load an edge list of the form '<u> <v>' (with
+		an optional weight) into a symmetric CSR
+		adjacency matrix.
+
+		Returns
+		-------
+		A: sp.csr_matrix
+			Adjacency matrix over the nodes present.
+
+		nodes: np.ndarray
+			Original id of each row of A.
+	"""
+	edges = np.loadtxt(fname, ndmin=2)
+	if edges.shape[1] > 2:
+		w = edges[:, 2]
+	else:
+		w = np.ones(len(edges))
+
+	nodes, idx = np.unique(edges[:, :2].astype(np.int64),
+							return_inverse=True)
+	u, v = idx.reshape((-1, 2)).T
+
+	n = len(nodes)
+	A = sp.coo_matrix((np.concatenate([w, w]),
+					(np.concatenate([u, v]), np.concatenate([v, u]))),
+					shape=(n, n))
+
+	return A.tocsr(), nodes
+
+def degree_stats(A):
+	""" Degree and connected component statistics. """
+	deg = np.asarray((A > 0).sum(axis=1)).ravel()
+	n_comp, comp = connected_components(A, directed=False)
+	sizes = np.bincount(comp)
+
+	return {'n_nodes': A.shape[0],
+			'n_edges': int((A > 0).sum()) // 2,
+			'degree_mean': deg.mean(),
+			'degree_max': int(deg.max()),
+			'degree_hist': np.bincount(deg),
+			'n_components': n_comp,
+			'component_sizes': np.sort(sizes)[::-1],
+			'components': comp}
+
+def _membership(labels, n_comms):
+	""" Sparse node x community indicator matrix. """
+	n = len(labels)
+	return sp.csr_matrix((np.ones(n), (np.arange(n), labels)),
+						shape=(n, n_comms))
+
+def _modularity(rows, cols, w, k, labels):
+	""" Modularity from the COO entries and
+		the degrees of the adjacency matrix. """
+	m2 = k.sum()
+	inner = w[labels[rows] == labels[cols]].sum()
+	tot = np.bincount(labels, weights=k)
+
+	return inner / m2 - ((tot / m2) ** 2).sum()
+
+def modularity(A, labels):
+	""" Newman modularity of a partition. """
+	A = A.tocoo()
+	k = np.asarray(A.sum(axis=1)).ravel()
+
+	return _modularity(A.row, A.col, A.data, k, labels)
+
+def _relabel(labels):
+	""" Renumber labels to 0..n_comms-1. """
+	_uniq, labels = np.unique(labels, return_inverse=True)
+	return labels
+
+def _local_moves(A, rng, max_sweeps=100, move_frac=0.5, 
+				min_frac=1e-3, tol=1e-4):
+	""" One level of Louvain: move nodes to the
+		neighbouring community with the best
+		modularity gain until nothing improves.
+
+		All gains of a sweep are computed at once from
+		the node x community weights A.M. As the nodes
+		move together, only a random fraction of the
+		improving nodes moves in each sweep. A sweep
+		which lowers the modularity is undone and the
+		fraction halved, until it falls below min_frac.
+		Stops once a sweep gains less than tol.
+	"""
+	n = A.shape[0]
+	k = np.asarray(A.sum(axis=1)).ravel()
+	m2 = k.sum()
+	self_loops = A.diagonal()
+	labels = np.arange(n)
+
+	coo = A.tocoo()
+	entries = (coo.row, coo.col, coo.data, k)
+	q = _modularity(*(entries + (labels,)))
+
+	for _sweep in range(max_sweeps):
+		tot = np.bincount(labels, weights=k, minlength=n)
+
+		# Weights from every node to neighbouring communities,
+		# in CSR order so the entries of a row are contiguous
+		K = A.dot(_membership(labels, n)).tocsr()
+		rows = np.repeat(np.arange(n), np.diff(K.indptr))
+		comms, w = K.indices, K.data
+
+		# Gain of joining each neighbouring community,
+		# and of staying (leaving and rejoining) in its own
+		own = comms == labels[rows]
+		tot_c = tot[comms] - np.where(own, k[rows], 0.0)
+		w = w - np.where(own, self_loops[rows], 0.0)
+		gain = w - k[rows] * tot_c / m2
+
+		stay_gain = -k * (tot[labels] - k) / m2
+		stay_gain[rows[own]] = gain[own]
+
+		# Best community of each node
+		nonempty = np.flatnonzero(np.diff(K.indptr))
+		row_max = np.full(n, -np.inf)
+		row_max[nonempty] = np.maximum.reduceat(gain, 
+									K.indptr[nonempty])
+		is_max = np.flatnonzero(gain == row_max[rows])
+		_uniq, first = np.unique(rows[is_max], return_index=True)
+		best = is_max[first]
+
+		best_rows = rows[best]
+		improves = gain[best] > stay_gain[best_rows] + 1e-12
+		movers = best_rows[improves]
+		targets = comms[best][improves]
+		if len(movers) == 0:
+			break
+
+		pick = rng.rand(len(movers)) < move_frac
+		if not pick.any():
+			pick[rng.randint(len(movers))] = True
+
+		new_labels = labels.copy()
+		new_labels[movers[pick]] = targets[pick]
+		new_q = _modularity(*(entries + (new_labels,)))
+
+		if new_q > q:
+			labels, q, gained = new_labels, new_q, new_q - q
+			if gained < tol:
+				break
+		else:
+			move_frac /= 2
+			if move_frac < min_frac:
+				break
+
+	return _relabel(labels)
+
+def louvain(A, seed=0, max_levels=20):
+	""" Louvain modularity clustering.
+
+		Parameters
+		----------
+		A: sp.csr_matrix
+			Symmetric adjacency matrix.
+
+		seed: int
+			Seed for the order of moves.
+
+		Returns
+		-------
+		labels: np.ndarray
+			Cluster of each node.
+
+		q: float
+			Modularity of the clustering.
+	"""
+	rng = np.random.RandomState(seed)
+	labels = np.arange(A.shape[0])
+	q = modularity(A, labels)
+
+	G = A
+	for _level in range(max_levels):
+		level = _local_moves(G, rng)
+		n_comms = level.max() + 1
+		if n_comms == G.shape[0]:
+			break
+
+		new_labels = level[labels]
+		new_q = modularity(A, new_labels)
+		if new_q <= q + 1e-12:
+			break
+		labels, q = new_labels, new_q
+
+		# Collapse the communities into nodes
+		M = _membership(level, n_comms)
+		G = M.T.dot(G).dot(M).tocsr()
+
+	return labels, q
+
+def save_clusters(nodes, labels, fname='data/mod-based-clusters.txt'):
+	""" Save clusters in the format of
+		mod-based-clusters.txt, '<node> <cluster>'. """
+	with open(fname, 'w') as f:
+		for node, label in zip(nodes, labels):
+			f.write(str(node) + ' ' + str(label) + '\n')
+
+def cluster_split(u_nodes, nodes, labels, test_size=0.2, seed=0):
+	""" Split edges into train and test sets so that
+		no cluster has edges on both sides.
+
+		Clusters are taken in a random order and each
+		is put in the test set if that brings it closer
+		to test_size of the edges. With few, large
+		clusters the split can still be far from
+		test_size, in which case a warning is printed.
+
+		Parameters
+		----------
+		u_nodes: np.ndarray
+			Node id of one end of each edge (eg. the
+			viruses, as in graph_info.pkl), which decides
+			its cluster.
+
+		nodes, labels: np.ndarray
+			Node ids and their clusters, from louvain().
+
+		Returns
+		-------
+		train, test: np.ndarray
+			Boolean masks over the edges.
+	"""
+	pos = np.searchsorted(nodes, u_nodes)
+	pos = np.minimum(pos, len(nodes) - 1)
+	if (nodes[pos] != u_nodes).any():
+		raise ValueError("Edges have nodes which are not clustered.")
+	edge_labels = labels[pos]
+
+	sizes = np.bincount(edge_labels, minlength=labels.max() + 1)
+	rng = np.random.RandomState(seed)
+	order = rng.permutation(len(sizes))
+
+	# Add the clusters which move the test set
+	# closer to its target size
+	target = test_size * len(u_nodes)
+	in_test = np.zeros(len(sizes), dtype=bool)
+	total = 0
+	for c in order:
+		if abs(total + sizes[c] - target) < abs(total - target):
+			in_test[c] = True
+			total += sizes[c]
+
+	# At least one cluster, the closest to the target
+	if not in_test.any():
+		in_test[np.argmin(np.abs(sizes - target))] = True
+
+	test = in_test[edge_labels]
+
+	frac = test.mean()
+	if abs(frac - test_size) > SPLIT_TOLERANCE:
+		print "Warning: the clusters are too coarse, the test " + \
+			"set holds", frac, "of the edges instead of", test_size
+
+	return ~test, test
+
+def main():
+	# Parser arguments
+	parser = argparse.ArgumentParser(
+		description='Clusters the virulence graph by modularity.')
+
+	parser.add_argument('-e', '--edges', nargs='?',
+		default='data/edges.txt', type=str,
+		help="Edge list to cluster.")
+	parser.add_argument('-o', '--out', nargs='?',
+		default='data/mod-based-clusters.txt', type=str,
+		help="File to save the clusters to.")
+	parser.add_argument('-s', '--seed', nargs='?', default=0,
+		type=int, help="Random seed.")
+
+	args = parser.parse_args()
+
+	A, nodes = load_edges(args.edges)
+	stats = degree_stats(A)
+	print "Nodes =", stats['n_nodes'], "Edges =", stats['n_edges']
+	print "Components =", stats['n_components'], \
+		"Largest =", stats['component_sizes'][0]
+
+	labels, q = louvain(A, args.seed)
+	print "Clusters =", labels.max() + 1, "Modularity =", q
+
+	save_clusters(nodes, labels, args.out)
+
+if __name__ == "__main__":
+	main()
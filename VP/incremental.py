@@ -0,0 +1,289 @@
+#!usr/bin/python
+
+import os
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+
+import features
+from config import DATA_REPO, PRECISION
+from features import encoded_seq_from_file, pad_sequences
+from reduce_dimension import reconstruction_error, features_fname, \
+							load_reduced, save_reduced
+
+# Refit once the strains appended since the last full
+# run exceed this fraction of the strains it was fit on.
+REFIT_FRACTION = 0.2
+
+# Refit once the reconstruction error of appended
+# strains exceeds this multiple of the fit error.
+REFIT_ERROR = 2.0
+
+def state_fname(particle, index):
+	""" File name of the stored state of a full run. """
+	return 'data/' + particle + '_' + index + '_state'
+
+def save_fit_state(state, particle, index):
+	""" Save the state filled in by extract_features()
+		and reduce_dimension() during a full run.
+	"""
+	state.setdefault('n_appended', 0)
+	with open(state_fname(particle, index), 'w') as f:
+		pickle.dump(state, f)
+
+def load_fit_state(particle, index):
+	""" Load the state of the last full run. """
+	with open(state_fname(particle, index)) as f:
+		return pickle.load(f)
+
+def _encode_new(new_dir, particle, index, state, drift):
+	""" Encode the new strains segment by segment with
+		the column masks and padding length of the full
+		run, and concatenate them in the same file order.
+	"""
+	max_len = state['global_max_len']
+
+	encs = []
+	for fname in state['files']:
+		if not os.path.exists(new_dir + '/' + fname):
+			encs.append({})
+			continue
+
+		mask = state['col_masks'][fname]
+		enc = encoded_seq_from_file(fname, new_dir, particle,
+									index)
+
+		# States saved before the widths were kept
+		# only know the width of masked files
+		expected = state.get('widths', {}).get(fname)
+		if expected is None and mask is not None:
+			expected = len(mask)
+
+		# Alignment no longer matches the stored columns
+		width = len(enc.values()[0])
+		if expected is not None and width != expected:
+			drift['changed_files'].append(fname)
+		elif mask is not None:
+			for k in enc.keys():
+				enc[k] = enc[k][mask]
+			width = int(mask.sum())
+
+		if width > max_len:
+			drift['truncated_files'].append(fname)
+
+		encs.append(enc)
+
+	keys = sorted(set().union(*[enc.keys() for enc in encs]))
+
+	# Missing segments are zeros, as in pad_dict()
+	X = np.zeros((len(keys), len(encs) * max_len), dtype=PRECISION)
+	for j, enc in enumerate(encs):
+		if not enc:
+			continue
+		vals = [enc.get(k, np.zeros((1,), dtype=PRECISION)) for k in keys]
+		vals = pad_sequences(vals, maxlen=max_len, dtype=PRECISION,
+					padding='pre', truncating='pre', value=0.0)
+		X[:, j * max_len:(j + 1) * max_len] = vals
+
+	return keys, X
+
+def _register(keys, particle):
+	""" Add the new strains to the orders registry
+		and save it.
+	"""
+	with open(DATA_REPO + '/orders') as f:
+		orders = pickle.load(f)
+	v_order, m_order, inv_v_order, inv_m_order = orders
+
+	if particle == 'virus':
+		order, inv_order = v_order, inv_v_order
+	else:
+		order, inv_order = m_order, inv_m_order
+
+	next_id = max(v_order.values() + m_order.values()) + 1
+	for k in keys:
+		if k not in order:
+			order[k] = next_id
+			inv_order[next_id] = k
+			next_id += 1
+
+	with open(DATA_REPO + '/orders', 'w') as f:
+		pickle.dump(orders, f)
+
+	# Keep the id sets of features.py in sync
+	features.ids_set_virus.update(v_order.keys())
+	features.ids_set_mouse.update(m_order.keys())
+
+def _update_features(keys, X_reduced, particle, index):
+	""" Add or replace the rows of the new strains
+		in the saved features.
+	"""
+	old_keys, X = load_reduced(features_fname(particle, index))
+
+	new = dict(zip(keys, range(len(keys))))
+	keep = np.array([k not in new for k in old_keys], dtype=bool)
+
+	keys = np.concatenate([old_keys[keep], np.array(keys, dtype=object)])
+	X = np.concatenate([X[keep], X_reduced], axis=0)
+	save_reduced(keys, X, particle, index)
+
+	return keys, X
+
+def add_strain_names(strain_names, save=True):
+	""" Add the names of new viruses, by Type-num, to
+		viruses_dict so their sequences can be read. """
+	if strain_names:
+		features.viruses_dict.update(strain_names)
+		if save:
+			with open(DATA_REPO + '/viruses_dict', 'w') as f:
+				pickle.dump(features.viruses_dict, f)
+
+def load_strain_names(fname):
+	""" Read the names of new viruses from a CSV file
+		of '<Type-num>,<name>' lines, as needed by
+		append_strains(). """
+	df = pd.read_csv(fname, header=None, names=['type_num', 'name'],
+					dtype=str)
+	return dict(zip(df['type_num'].str.strip(), df['name'].str.strip()))
+
+def embed_strains(new_dir, particle, index, state=None, drift=None):
+	""" Reduce the features of new strains with the
+		reducer of the last full run, without saving
+		anything.
+
+		Returns the names of the strains, their
+		features before reduction (non-zero columns
+		only) and the reduced features.
+	"""
+	if state is None:
+		state = load_fit_state(particle, index)
+	if drift is None:
+		drift = {'changed_files': [], 'truncated_files': []}
+
+	keys, X = _encode_new(new_dir, particle, index, state, drift)
+
+	# Reduce with the stored reducer
+	X = X[:, state['nonzero']]
+	X_reduced = state['reducer'].transform(X)
+
+	return keys, X, X_reduced
+
+def append_strains(new_dir, particle, index, strain_names=None,
+					save=True, force=False):
+	""" Append new strains to the features without
+		rerunning the full pipeline.
+
+		The strains are encoded with the padding length,
+		column masks and reducer stored by the last full
+		run, so the existing features do not change.
+
+		Parameters
+		----------
+		new_dir: str
+			Directory of preprocessed files for the new
+			strains, named like those in data/<particle>.
+			The sequences should be aligned to the stored
+			alignments (eg. by a MUSCLE profile alignment).
+
+		particle: str
+			'virus' or 'mouse'.
+
+		index: str
+			Index from AAindex used for the features.
+
+		strain_names: dict
+			Names for the Type-nums of new viruses, which
+			are added to viruses_dict.
+
+		save: bool
+			Set True to update orders and the features on disc.
+
+		force: bool
+			Set True to save even if a refit is needed.
+
+		Returns
+		-------
+		X_reduced: np.ndarray
+			Reduced features of the new strains.
+
+		drift: dict
+			What changed since the full run. If
+			drift['needs_refit'] is True, the pipeline
+			should be rerun from scratch, and nothing is
+			saved unless force is set. drift['saved'] tells
+			if the features were updated.
+	"""
+	state = load_fit_state(particle, index)
+	if state['fit_error'] is None:
+		raise ValueError("The reducer of the last full run " + \
+						"cannot transform new strains.")
+
+	add_strain_names(strain_names, save)
+
+	drift = {'changed_files': [], 'truncated_files': []}
+	keys, X, X_reduced = embed_strains(new_dir, particle, index,
+										state, drift)
+
+	# Measure drift
+	n_appended = state['n_appended'] + len(keys)
+	error = reconstruction_error(state['reducer'], X, X_reduced).mean()
+
+	drift['n_appended'] = n_appended
+	drift['error_ratio'] = error / max(state['fit_error'], 1e-12)
+	drift['needs_refit'] = bool(drift['changed_files'] or
+		drift['truncated_files'] or
+		n_appended > REFIT_FRACTION * state['n_fit'] or
+		drift['error_ratio'] > REFIT_ERROR)
+
+	drift['saved'] = bool(save and (force or not drift['needs_refit']))
+	if drift['saved']:
+		_register(keys, particle)
+		_update_features(keys, X_reduced, particle, index)
+
+		state['n_appended'] = n_appended
+		save_fit_state(state, particle, index)
+
+	return X_reduced, drift
+
+def main():
+	# Parser arguments
+	parser = argparse.ArgumentParser(
+		description='Appends new strains to the features.')
+
+	parser.add_argument('-d', '--new_dir', nargs='?',
+		type=str, help="Directory of preprocessed new strains.")
+	parser.add_argument('-p', '--particle', nargs='?',
+		choices=['virus', 'mouse'], type=str,
+		help="'mouse' or 'virus'")
+	parser.add_argument('-i', '--index', nargs='?',
+		default='JOND920101', type=str,
+		help="Index from AAindex used for the features.")
+	parser.add_argument('-n', '--names', nargs='?',
+		default=None, type=str,
+		help="CSV of '<Type-num>,<name>' lines for new viruses.")
+
+	parser.add_argument('-f', '--force',
+		help="Set True to append even if a refit is needed",
+		action='store_true')
+
+	args = parser.parse_args()
+
+	strain_names = None
+	if args.names:
+		strain_names = load_strain_names(args.names)
+
+	X_reduced, drift = append_strains(args.new_dir, args.particle,
+										args.index, strain_names,
+										force=args.force)
+
+	if drift['needs_refit']:
+		print "Drift since the last full run is too large, " + \
+				"rerun get_features.py."
+	if drift['saved']:
+		print "Appended", len(X_reduced), "strains."
+	else:
+		print "Nothing saved, pass --force to append anyway."
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,248 @@
+#!usr/bin/python
+
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+
+from sklearn.neighbors import KDTree
+from reduce_dimension import features_fname, load_reduced
+
+# Largest number of points searched by brute force
+# when the method is 'auto'.
+BRUTE_MAX = 2000
+
+def load_embeddings(fname):
+	""" Load the reduced embeddings saved by
+		reduce_dimension() and split them into
+		the names and the feature matrix.
+	"""
+	keys, X = load_reduced(fname)
+
+	return keys, np.asarray(X, dtype=np.float64)
+
+class KNNIndex():
+
+	def __init__(self, keys, X, method='auto', leaf_size=40):
+		""" Nearest neighbour index over embeddings.
+
+			Parameters
+			----------
+			keys: np.ndarray
+				Names of the rows of X.
+
+			X: np.ndarray
+				Embeddings of shape (n_samples, n_dims).
+
+			method: str
+				'brute' for an exact search by matrix products,
+				'tree' for a KD-tree, 'auto' to choose by size.
+
+			leaf_size: int
+				Leaf size of the KD-tree.
+		"""
+
+		self.keys = np.asarray(keys, dtype=object)
+
+		# Arrays attached with shared_arrays.attach()
+		# are used as they are, without a copy
+		self.X = np.asarray(X)
+		if self.X.dtype not in (np.float32, np.float64):
+			self.X = self.X.astype(np.float64)
+		self.key_pos = dict((k, i) for i, k in enumerate(self.keys))
+
+		if method == 'auto':
+			method = 'brute' if len(self.X) <= BRUTE_MAX else 'tree'
+		self.method = method
+
+		if self.method == 'brute':
+			self._sq_norms = (self.X ** 2).sum(axis=1)
+			self._tree = None
+		elif self.method == 'tree':
+			self._tree = KDTree(self.X, leaf_size=leaf_size)
+		else:
+			raise ValueError("Unknown method '" + method + "'.")
+
+	def query(self, Q, k=5):
+		""" Find the k nearest neighbours of each row of Q.
+
+			Returns
+			-------
+			dist, ind: np.ndarray
+				Arrays of shape (n_queries, k) with the euclidean
+				distances and the row numbers of the neighbours,
+				sorted from nearest to farthest.
+		"""
+		Q = np.atleast_2d(np.asarray(Q, dtype=np.float64))
+		k = min(k, len(self.X))
+
+		if self._tree is not None:
+			return self._tree.query(Q, k=k)
+
+		# Squared distances from the norms and one product
+		d2 = (Q ** 2).sum(axis=1)[:, None] - 2 * Q.dot(self.X.T) + \
+				self._sq_norms[None, :]
+		d2 = np.maximum(d2, 0.0)
+
+		# Select the k smallest and then sort only those
+		ind = np.argpartition(d2, k - 1, axis=1)[:, :k]
+		rows = np.arange(len(Q))[:, None]
+		order = np.argsort(d2[rows, ind], axis=1)
+		ind = ind[rows, order]
+
+		return np.sqrt(d2[rows, ind]), ind
+
+	def neighbours(self, Q, k=5):
+		""" Names of the k nearest neighbours of each row of Q. """
+		_dist, ind = self.query(Q, k)
+		return self.keys[ind]
+
+	def vectors(self, names):
+		""" Embeddings for a list of names. """
+		return self.X[[self.key_pos[n] for n in names]]
+
+	def save(self, fname):
+		""" Save the index to disc. """
+		with open(fname, 'w') as f:
+			pickle.dump(self, f)
+
+def index_fname(particle, index):
+	""" File name of the index, next to the features. """
+	return 'data/' + particle + '_' + index + '_knn'
+
+def load_index(fname):
+	""" Load an index saved by KNNIndex.save(). """
+	with open(fname) as f:
+		return pickle.load(f)
+
+def build_index(particle, index, method='auto', save=True):
+	""" Build the nearest neighbour index over the
+		reduced features of a particle.
+	"""
+	keys, X = load_embeddings(features_fname(particle, index))
+	knn = KNNIndex(keys, X, method=method)
+
+	if save:
+		knn.save(index_fname(particle, index))
+
+	return knn
+
+def knn_virulence(knn, df, k=5, n_search=None, rows=None):
+	""" Estimate the virulence of each (virus, host) row
+		in df from the k nearest viruses with a known
+		virulence for the same host. The virus itself,
+		and any virus with an identical embedding, is
+		left out, so this scores unseen viruses.
+
+		Parameters
+		----------
+		knn: KNNIndex
+			Index over the virus embeddings.
+
+		df: pd.DataFrame
+			Rows of 'influenza_strain', 'host_strain' and
+			'virulence_level', as in merged_bi.csv.
+
+		k: int
+			Number of labelled neighbours to average.
+
+		n_search: int
+			Number of neighbours searched per virus,
+			all of them by default.
+
+		rows: pd.DataFrame
+			Pairs of 'influenza_strain' and 'host_strain'
+			to estimate, the rows of df by default.
+
+		Returns
+		-------
+		est: np.ndarray
+			Estimated virulence for each row. Rows
+			with no labelled neighbour get the host mean.
+	"""
+
+	# Matrix of virulence, NaN where unknown
+	labels = df.pivot_table(index='influenza_strain',
+							columns='host_strain',
+							values='virulence_level',
+							aggfunc='mean')
+	labels = labels.reindex(knn.keys)
+	L = labels.values
+
+	# Neighbours of every virus. The virus itself and
+	# viruses with the same embedding (eg. the .1 and .2
+	# copies of a strain) would leak its labels.
+	if n_search is None:
+		n_search = len(knn.keys) - 1
+	_dist, nbrs = knn.query(knn.X, n_search + 1)
+	same = (knn.X[nbrs] == knn.X[:, None, :]).all(axis=2)
+	same |= nbrs == np.arange(len(nbrs))[:, None]
+
+	# Virulence of the neighbours for each row
+	if rows is None:
+		rows = df
+	vs = np.array([knn.key_pos[v] for v in rows['influenza_strain']])
+	hs = labels.columns.get_indexer(rows['host_strain'])
+	if (hs < 0).any():
+		missing = sorted(set(np.asarray(rows['host_strain'])[hs < 0]))
+		raise ValueError("Hosts without known virulence: " + 
+						str(missing))
+	vals = L[nbrs[vs], hs[:, None]]
+	vals[same[vs]] = np.nan
+
+	# Average over the first k labelled neighbours
+	valid = ~np.isnan(vals)
+	use = valid & (np.cumsum(valid, axis=1) <= k)
+	total = np.where(use, vals, 0.0).sum(axis=1)
+	count = use.sum(axis=1)
+
+	host_mean = np.nanmean(L, axis=0)[hs]
+	est = np.where(count > 0, total / np.maximum(count, 1), host_mean)
+
+	return est
+
+def knn_baseline(fname, particle='virus', index='JOND920101', k=5):
+	""" Leave-one-virus-out accuracy of knn_virulence()
+		on a virulence dataset such as merged_bi.csv.
+	"""
+	df = pd.read_csv(fname, index_col=0)
+
+	knn = load_index(index_fname(particle, index))
+	df = df[df['influenza_strain'].isin(knn.key_pos)]
+
+	est = knn_virulence(knn, df, k)
+	pred = np.rint(est)
+	acc = (pred == df['virulence_level'].values).mean()
+
+	return acc
+
+def main():
+	# Parser arguments
+	parser = argparse.ArgumentParser(
+		description='Builds a nearest neighbour index over embeddings.')
+
+	parser.add_argument('-p', '--particle', nargs='?',
+		choices=['virus', 'mouse'], default='virus',
+		type=str, help="'mouse' or 'virus'")
+	parser.add_argument('-i', '--index', nargs='?',
+		default='JOND920101', type=str,
+		help="Index from AAindex used for the features.")
+	parser.add_argument('-m', '--method', nargs='?',
+		choices=['auto', 'brute', 'tree'], default='auto',
+		type=str, help="Search method.")
+	parser.add_argument('-k', nargs='?', default=5,
+		type=int, help="Neighbours used by the baseline.")
+	parser.add_argument('-b', '--baseline', nargs='?',
+		default=None, type=str,
+		help="Virulence dataset to score the kNN baseline on.")
+
+	args = parser.parse_args()
+	build_index(args.particle, args.index, args.method)
+
+	if args.baseline:
+		acc = knn_baseline(args.baseline, args.particle,
+							args.index, args.k)
+		print "kNN accuracy =", acc
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,271 @@
+#!usr/bin/python
+
+import argparse
+import numpy as np
+import pandas as pd
+
+from config import DATA_REPO
+
+def load_levels(fname=DATA_REPO + '/merged_bi.csv'):
+	""" Virulence levels of merged_bi.csv (0, 1) or
+		merged_tri.csv (0, 1, 2), in file order. """
+	df = pd.read_csv(fname, index_col=0)
+	return df['virulence_level'].values.astype(np.int64)
+
+def _squeeze(X, scores):
+	""" Drop the model axis if a single score array
+		was passed. """
+	if np.ndim(scores) == 1:
+		return X[0]
+	return X
+
+def _sorted(labels, scores):
+	""" Labels and scores of each model, sorted by
+		decreasing score.
+
+		Parameters
+		----------
+		labels: np.ndarray
+			Boolean (or 0/1) labels of shape (n,), or
+			(n_models, n) if they differ by model.
+
+		scores: np.ndarray
+			Scores of shape (n,) or (n_models, n).
+
+		Levels such as those of merged_tri.csv must be
+		binarised first, eg. levels >= 1.
+	"""
+	scores = np.atleast_2d(np.asarray(scores, dtype=np.float64))
+	labels = np.asarray(labels)
+	if labels.dtype != bool:
+		if not np.isin(labels, [0, 1]).all():
+			raise ValueError("Labels must be boolean or 0/1, " + \
+							"got " + str(np.unique(labels)))
+		labels = labels.astype(bool)
+	labels = np.broadcast_to(labels, scores.shape)
+
+	order = np.argsort(-scores, axis=1, kind='mergesort')
+	rows = np.arange(len(scores))[:, None]
+
+	return labels[rows, order], scores[rows, order]
+
+def _counts(y):
+	""" True and false positives when the i highest
+		scores are predicted positive, for i = 0..n. """
+	m, n = y.shape
+	tp = np.zeros((m, n + 1))
+	tp[:, 1:] = np.cumsum(y, axis=1)
+	fp = np.arange(n + 1) - tp
+
+	return tp, fp
+
+def threshold_curve(labels, scores):
+	""" All thresholds of a set of scores from one
+		sort. A score above the threshold is
+		predicted positive, as in the accuracy()
+		of the Collaborative Filtering notebook.
+
+		Returns
+		-------
+		thres: np.ndarray
+			Thresholds of shape (n_models, n + 1). Column
+			i is halfway between the i-th and (i + 1)-th
+			highest scores, so that the i highest are
+			positive. Columns which fall inside tied
+			scores are NaN.
+
+		tp, fp: np.ndarray
+			True and false positives at each threshold.
+	"""
+	y, s = _sorted(labels, scores)
+	tp, fp = _counts(y)
+
+	thres = np.empty(tp.shape)
+	thres[:, 0] = s[:, 0]
+	thres[:, 1:-1] = (s[:, :-1] + s[:, 1:]) / 2
+	thres[:, -1] = -np.inf
+	thres[:, 1:-1][s[:, :-1] == s[:, 1:]] = np.nan
+
+	return _squeeze(thres, scores), _squeeze(tp, scores), \
+		_squeeze(fp, scores)
+
+def accuracy(labels, scores, thres):
+	""" Accuracy of predicting positive when the score
+		is above thres, for any number of thresholds
+		and models at once.
+
+		Returns an array of shape (n_models, n_thres),
+		without the axes of a 1-d scores or a scalar
+		thres.
+	"""
+	y, s = _sorted(labels, scores)
+	tp, fp = _counts(y)
+	m, n = y.shape
+	thres = np.asarray(thres, dtype=np.float64)
+
+	# Number of scores above each threshold
+	asc = s[:, ::-1]
+	above = n - np.vstack([np.searchsorted(row, thres.ravel(),
+											side='right')
+							for row in asc])
+
+	rows = np.arange(m)[:, None]
+	n_neg = n - y.sum(axis=1)[:, None]
+	acc = (tp[rows, above] + n_neg - fp[rows, above]) / float(n)
+
+	acc = acc.reshape((m,) + thres.shape)
+	return _squeeze(acc, scores)
+
+def precision_recall(labels, scores):
+	""" Precision and recall at every threshold of
+		threshold_curve(). Both are NaN inside ties,
+		and precision is NaN when nothing is
+		predicted positive.
+
+		Returns precision, recall and thresholds.
+	"""
+	thres, tp, fp = threshold_curve(labels, scores)
+	n_pos = tp[..., -1:]
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		precision = tp / (tp + fp)
+		recall = tp / n_pos
+
+	ties = np.isnan(thres)
+	precision[ties] = np.nan
+	recall[ties] = np.nan
+
+	return precision, recall, thres
+
+def roc_auc(labels, scores):
+	""" Area under the ROC curve of each model, from
+		the ranks of the scores (ties share their
+		average rank). NaN if one class is missing.
+	"""
+	y, s = _sorted(labels, scores)
+	m, n = y.shape
+
+	# Average rank of each group of tied scores,
+	# numbered across all models at once
+	new = np.ones((m, n), dtype=bool)
+	new[:, 1:] = s[:, 1:] != s[:, :-1]
+	group = np.cumsum(new.ravel()) - 1
+	pos = np.tile(np.arange(n, 0, -1), m).astype(np.float64)
+	ranks = np.bincount(group, weights=pos) / np.bincount(group)
+	ranks = ranks[group].reshape((m, n))
+
+	n_pos = y.sum(axis=1).astype(np.float64)
+	n_neg = n - n_pos
+	with np.errstate(divide='ignore', invalid='ignore'):
+		auc = ((ranks * y).sum(axis=1) - n_pos * (n_pos + 1) / 2) / \
+			(n_pos * n_neg)
+
+	return _squeeze(auc, scores)
+
+def best_threshold(labels, scores):
+	""" Threshold of highest accuracy for each model,
+		searched over all cuts of threshold_curve()
+		instead of a fixed grid.
+
+		Returns the thresholds and their accuracies.
+	"""
+	thres, tp, fp = threshold_curve(labels, scores)
+	thres, tp, fp = np.atleast_2d(thres, tp, fp)
+	n = tp.shape[1] - 1
+	n_neg = n - tp[:, -1:]
+
+	acc = (tp + n_neg - fp) / float(n)
+	acc[np.isnan(thres)] = -1.0
+	best = np.argmax(acc, axis=1)
+
+	rows = np.arange(len(acc))
+	return _squeeze(thres[rows, best], scores), \
+		_squeeze(acc[rows, best], scores)
+
+def predict_levels(scores, thres):
+	""" Virulence level of each score, the number of
+		ordinal thresholds it is above.
+
+		thres has shape (n_levels - 1,), or
+		(n_models, n_levels - 1) for batched scores.
+	"""
+	scores = np.asarray(scores)
+	thres = np.asarray(thres)
+	return (scores[..., None] > thres[..., None, :]).sum(axis=-1)
+
+def ordinal_thresholds(levels, scores):
+	""" Best thresholds between consecutive virulence
+		levels, eg. 0|1 and 1|2 for merged_tri.csv.
+
+		Each threshold separates the levels above it
+		from those below, and they are made
+		non-decreasing so that predict_levels() is
+		well defined.
+
+		Returns the thresholds, of shape (n_levels - 1,)
+		or (n_models, n_levels - 1), and the accuracy
+		of predict_levels() with them.
+	"""
+	levels = np.asarray(levels)
+	thres = [np.atleast_1d(best_threshold(levels >= k, scores)[0])
+			for k in range(1, levels.max() + 1)]
+	thres = np.maximum.accumulate(np.vstack(thres).T, axis=1)
+
+	pred = predict_levels(np.atleast_2d(scores), thres)
+	acc = (pred == levels).mean(axis=-1)
+
+	return _squeeze(thres, scores), _squeeze(acc, scores)
+
+def evaluate(levels, scores):
+	""" Metrics of binary or tri-level virulence
+		predictions of one or many models.
+
+		Parameters
+		----------
+		levels: np.ndarray
+			Virulence levels, eg. from load_levels().
+
+		scores: np.ndarray
+			Predicted virulence of shape (n,) or
+			(n_models, n). Higher means more virulent.
+
+		Returns
+		-------
+		dict with, for each boundary between levels,
+		'auc' and the best 'thresholds', and the
+		'accuracy' of predicting levels with them.
+	"""
+	levels = np.asarray(levels)
+	auc = [np.atleast_1d(roc_auc(levels >= k, scores))
+			for k in range(1, levels.max() + 1)]
+	thres, acc = ordinal_thresholds(levels, scores)
+
+	return {'auc': _squeeze(np.vstack(auc).T, scores),
+			'thresholds': thres,
+			'accuracy': acc}
+
+def main():
+	# Parser arguments
+	parser = argparse.ArgumentParser(
+		description='Evaluates predicted virulence levels.')
+
+	parser.add_argument('-l', '--levels', nargs='?',
+		default=DATA_REPO + '/merged_bi.csv', type=str,
+		help="merged_bi.csv or merged_tri.csv.")
+	parser.add_argument('-s', '--scores', nargs='?', type=str,
+		help="Scores saved with np.save(), of shape (n,) or " + \
+			"(n_models, n), in the order of the levels file.")
+
+	args = parser.parse_args()
+	levels = load_levels(args.levels)
+	scores = np.atleast_2d(np.load(args.scores))
+
+	res = evaluate(levels, scores)
+	for i in range(len(scores)):
+		print "Model", i
+		print "\tAUC =", res['auc'][i]
+		print "\tThresholds =", res['thresholds'][i]
+		print "\tAccuracy =", res['accuracy'][i]
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,372 @@
+#!usr/bin/python
+
+import os
+import sys
+import glob
+import time
+import Queue
+import pickle
+import shutil
+import argparse
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from cache import _file_digest
+
+# Where the stamps of finished nodes are kept
+STAMP_DIR = 'data/.pipeline'
+
+def _files(paths):
+	""" All files under a list of files, directories
+		and glob patterns. """
+	found = []
+	for pattern in paths:
+		for path in sorted(glob.glob(pattern)):
+			if os.path.isdir(path):
+				for root, _dirs, fnames in os.walk(path):
+					found += [os.path.join(root, f) 
+								for f in sorted(fnames)]
+			else:
+				found.append(path)
+	return found
+
+def align_dir(in_dir, out_dir, suffix='', muscle='muscle'):
+	""" Align every file in in_dir ending with suffix
+		using MUSCLE and write the alignments to out_dir.
+		Large files are aligned with the faster settings
+		used in mouse_alignments.py.
+	"""
+	if not os.path.exists(out_dir):
+		os.makedirs(out_dir)
+
+	for fname in sorted(os.listdir(in_dir)):
+		if not fname.endswith(suffix):
+			continue
+
+		fin = in_dir + '/' + fname
+		fout = out_dir + '/' + fname[:len(fname) - len(suffix)]
+		cmd = [muscle, '-in', fin, '-out', fout]
+		if os.path.getsize(fin) >= 1000000:
+			cmd += ['-maxiters', '1', '-diags', '-sv']
+		subprocess.check_call(cmd)
+
+class Node():
+
+	def __init__(self, name, deps=(), inputs=(), outputs=(),
+				cmd=None, func=None, args=(), clean=False):
+		""" A step of the pipeline.
+
+			Parameters
+			----------
+			name: str
+				Name of the step.
+
+			deps: list
+				Names of the steps which must finish first.
+
+			inputs, outputs: list
+				Files, directories or glob patterns read and
+				written by the step, used to decide if it is
+				up to date.
+
+			cmd: list
+				Command to run in a subprocess.
+
+			func: function
+				Function to call with args instead of cmd.
+
+			clean: bool
+				Set True to delete the outputs before running,
+				for steps which append to their outputs.
+		"""
+
+		self.name = name
+		self.deps = list(deps)
+		self.inputs = list(inputs)
+		self.outputs = list(outputs)
+		self.cmd = cmd
+		self.func = func
+		self.args = args
+		self.clean = clean
+
+	def run(self):
+		""" Run the step. """
+		if self.clean:
+			for pattern in self.outputs:
+				for path in glob.glob(pattern):
+					if os.path.isdir(path):
+						shutil.rmtree(path)
+					else:
+						os.remove(path)
+
+		if self.cmd is not None:
+			subprocess.check_call(self.cmd)
+		else:
+			self.func(*self.args)
+
+class Pipeline():
+
+	def __init__(self, nodes, check='mtime'):
+		""" Runs the nodes of a dependency graph,
+			running independent nodes concurrently and
+			skipping those which are up to date.
+
+			check is 'mtime' to compare modification times
+			of inputs and outputs (as make does) or 'hash'
+			to compare the contents of the inputs with
+			those of the last run.
+		"""
+
+		self.nodes = dict((node.name, node) for node in nodes)
+		self.check = check
+		self.times = {}
+		self.skipped = set()
+
+		for node in nodes:
+			for dep in node.deps:
+				if dep not in self.nodes:
+					err = "Unknown dependency '" + dep + \
+						"' of '" + node.name + "'."
+					raise ValueError(err)
+
+		self.order = self._toposort()
+
+	def _toposort(self):
+		""" Order the nodes so that every node comes
+			after its dependencies. """
+		order, marks = [], {}
+
+		def visit(name):
+			if marks.get(name) == 'done':
+				return
+			if marks.get(name) == 'open':
+				raise ValueError("Cycle through '" + name + "'.")
+			marks[name] = 'open'
+			for dep in self.nodes[name].deps:
+				visit(dep)
+			marks[name] = 'done'
+			order.append(name)
+
+		for name in sorted(self.nodes):
+			visit(name)
+
+		return order
+
+	def _stamp_fname(self, node):
+		return STAMP_DIR + '/' + node.name
+
+	def _digest(self, node):
+		""" Digests of all inputs of a node. """
+		return [(path, _file_digest(path)) for path in _files(node.inputs)]
+
+	def up_to_date(self, node):
+		""" Check if the outputs of a node are newer
+			than (or made from the same) inputs. """
+		if not node.outputs:
+			return False
+
+		# Every output must exist
+		if not all([_files([p]) for p in node.outputs]):
+			return False
+		outputs = _files(node.outputs)
+
+		if self.check == 'hash':
+			try:
+				with open(self._stamp_fname(node)) as f:
+					return pickle.load(f) == self._digest(node)
+			except IOError:
+				return False
+
+		inputs = _files(node.inputs)
+		if not inputs:
+			return True
+		newest = max([os.path.getmtime(p) for p in inputs])
+		oldest = min([os.path.getmtime(p) for p in outputs])
+
+		return newest <= oldest
+
+	def _run_node(self, name, force):
+		""" Run one node in a worker thread. """
+		node = self.nodes[name]
+		start = time.time()
+		try:
+			if not force and self.up_to_date(node):
+				return name, start, start, True, None
+
+			node.run()
+
+			if self.check == 'hash':
+				if not os.path.exists(STAMP_DIR):
+					os.makedirs(STAMP_DIR)
+				with open(self._stamp_fname(node), 'w') as f:
+					pickle.dump(self._digest(node), f)
+
+			return name, start, time.time(), False, None
+		except Exception as e:
+			return name, start, time.time(), False, e
+
+	def run(self, workers=4, force=False):
+		""" Run the pipeline. Nodes are started as soon
+			as all their dependencies have finished.
+
+			Raises a RuntimeError with the failed node if
+			any node fails, after the running ones finish.
+		"""
+		pool = ThreadPool(workers)
+		results = Queue.Queue()
+
+		done, started, failed = set(), set(), None
+		while len(done) < len(self.nodes):
+			if failed is None:
+				for name in self.order:
+					deps = self.nodes[name].deps
+					if name not in started and set(deps) <= done:
+						started.add(name)
+						pool.apply_async(self._run_node,
+										(name, force),
+										callback=results.put)
+
+			if len(started) == len(done):
+				break
+
+			name, start, end, skipped, err = results.get()
+			done.add(name)
+			self.times[name] = (start, end)
+
+			if skipped:
+				self.skipped.add(name)
+				print "Up to date:", name
+			elif err is not None:
+				print "Failed:", name, err
+				failed = (name, err)
+			else:
+				print "Finished:", name, "(%.1fs)" % (end - start)
+
+		pool.close()
+		pool.join()
+
+		if failed is not None:
+			raise RuntimeError("Node '" + failed[0] + "' failed: " + \
+								str(failed[1]))
+
+	def critical_path(self):
+		""" The chain of dependent nodes which took the
+			longest in the last run, and its duration.
+		"""
+		cost, prev = {}, {}
+		for name in self.order:
+			start, end = self.times.get(name, (0.0, 0.0))
+			best = None
+			for dep in self.nodes[name].deps:
+				if best is None or cost[dep] > cost[best]:
+					best = dep
+			prev[name] = best
+			cost[name] = (end - start) + (cost[best] if best else 0.0)
+
+		name = max(cost, key=cost.get)
+		total = cost[name]
+		path = []
+		while name is not None:
+			path.append(name)
+			name = prev[name]
+
+		return path[::-1], total
+
+def build_pipeline(index='JOND920101', muscle='muscle',
+					mouse_dir='per-mouse-protein', check='mtime'):
+	""" The feature pipeline for both particles and
+		the graph, as run from the VP directory.
+
+		virus: collect -> strip -> align -> preprocess -> features
+		mouse: align -> preprocess -> features
+		graph: graph_info
+
+		The features step extracts and reduces in one
+		process, as the extracted features are kept
+		in memory between the two.
+	"""
+	py = sys.executable
+
+	def features(particle):
+		return Node(particle + '_features',
+			deps=[particle + '_preprocess'],
+			inputs=['data/' + particle],
+			outputs=['data/' + particle + '_' + index],
+			cmd=[py, 'get_features.py', '-p', particle,
+				'-i', index, '-s'])
+
+	def preprocess(particle):
+		return Node(particle + '_preprocess',
+			deps=[particle + '_align'],
+			inputs=['data/aligned/' + particle],
+			outputs=['data/' + particle, 'data/' + particle + '_stats'],
+			cmd=[py, 'preprocess_align.py', '-p', particle,
+				'-d', 'data/aligned/' + particle, '-ow'])
+
+	nodes = [
+		# Virus branch
+		Node('virus_collect',
+			inputs=['proteomes_virus'], outputs=['Segments'],
+			cmd=[py, 'collect_segments.py'], clean=True),
+		Node('virus_strip', deps=['virus_collect'],
+			inputs=['Segments/Seg*[0-9]'], outputs=['Segments/*_new'],
+			cmd=[py, 'remove_terminals.py', '-d', 'Segments']),
+		Node('virus_align', deps=['virus_strip'],
+			inputs=['Segments/*_new'], outputs=['data/aligned/virus'],
+			func=align_dir,
+			args=('Segments', 'data/aligned/virus', '_new', muscle)),
+		preprocess('virus'),
+		features('virus'),
+
+		# Mouse branch
+		Node('mouse_align',
+			inputs=[mouse_dir], outputs=['data/aligned/mouse'],
+			func=align_dir,
+			args=(mouse_dir, 'data/aligned/mouse', '', muscle)),
+		preprocess('mouse'),
+		features('mouse'),
+
+		# Graph
+		Node('graph_info',
+			inputs=['data/merged.csv', 'data/virus_order.pkl',
+					'data/mouse_order.pkl'],
+			outputs=['data/graph_info.pkl'],
+			cmd=[py, 'get_graph_info.py']),
+	]
+
+	return Pipeline(nodes, check)
+
+def main():
+	# Parser arguments
+	parser = argparse.ArgumentParser(
+		description='Runs the feature pipeline for viruses and mice.')
+
+	parser.add_argument('-i', '--index', nargs='?',
+		default='JOND920101', type=str,
+		help="Index from AAindex to use.")
+	parser.add_argument('-w', '--workers', nargs='?',
+		default=4, type=int, help="Nodes run at once.")
+	parser.add_argument('-m', '--muscle', nargs='?',
+		default='muscle', type=str, help="MUSCLE executable.")
+	parser.add_argument('-md', '--mouse_dir', nargs='?',
+		default='per-mouse-protein', type=str,
+		help="Directory of unaligned mouse proteins.")
+	parser.add_argument('-c', '--check', nargs='?',
+		choices=['mtime', 'hash'], default='mtime', type=str,
+		help="How to decide if a step is up to date.")
+	parser.add_argument('-f', '--force',
+		help="Set True to rerun every step", action='store_true')
+
+	args = parser.parse_args()
+	pipe = build_pipeline(args.index, args.muscle,
+						args.mouse_dir, args.check)
+
+	try:
+		pipe.run(args.workers, args.force)
+	finally:
+		path, total = pipe.critical_path()
+		print
+		print "Critical path (%.1fs):" % total, " -> ".join(path)
+
+if __name__ == "__main__":
+	main()
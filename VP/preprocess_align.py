@@ -7,19 +7,29 @@ import numpy as np
 import pandas as pd
 
 from config import AMINO_ACIDS
+from checkpoint import Journal
+from column_stats import N_SYMBOLS, column_counts, modes, \
+						save_counts, stats_path
+from alignment_store import EXT, is_store, save_as_store, AlignmentStore
 from quantiprot.utils.io import load_fasta_file
 from quantiprot.utils.sequence import SequenceSet, subset, columns
 
 # File IO Utility functions
 
-def get_fname(fname):
+def get_fname(fname, fmt='fasta'):
 	""" Get a new file name for any file
 		by just adding '_prep' to it.
+
+		The extension is '.fasta', or '.vpa' for
+		binary alignments (fmt='binary').
 	"""
 
 	fname = fname.split('.')
 	fname = fname[0]
-	fname += '_prep.fasta'
+	if fmt == 'binary':
+		fname += '_prep' + EXT
+	else:
+		fname += '_prep.fasta'
 	return fname
 
 def save_as_fasta(df, fname='prep.fasta'):
@@ -29,8 +39,8 @@ def save_as_fasta(df, fname='prep.fasta'):
 	
 	# Gets the sequences in fasta format
 	seqs = []
-	for index, row in df.iterrows():
-		seq = '>' + index + '\n' + row.str.cat(sep='') + '\n'
+	for index, row in zip(df.index, df.values):
+		seq = '>' + index + '\n' + ''.join(row) + '\n'
 		seqs.append(seq)
 
 	# Write to file
@@ -78,17 +88,20 @@ def replace_X_with_mode(df):
 		column after preprocessing, throws an error.
 	"""
 	
-	# Check which columns have anomalies
-	cols = check_anomaly(df).keys()
+	# Count the residues once, with 'X' as an extra
+	# symbol, instead of a mode() for each column
+	counts = column_counts(df, extra='X')
+	mode = modes(counts, extra='X')
+	columns = list(df.columns)
 	
-	# Replace 'X' with mode for each column
-	for col in cols:
-		mode = df[col].mode()[0]
-		if mode == 'X':
+	# Replace 'X' with mode for each column with an 'X'
+	for i in np.flatnonzero(counts[:, N_SYMBOLS]):
+		col = columns[i]
+		if mode[i] == 'X':
 			# If mode of column is 'X' then drop it.
 			df.drop([col], axis=1, inplace=True)
 		else:
-			df[col].replace('X', mode, inplace=True)
+			df[col].replace('X', mode[i], inplace=True)
 			
 	# Check that no anomalies are left
 	try:
@@ -107,8 +120,14 @@ def get_df_from_file(fname):
 		key of the dataframe.
 		
 		The sequence entries are a1, a2,... and so on.
+
+		Binary alignments (see alignment_store.py)
+		are read natively.
 	"""
 
+	if is_store(fname):
+		return AlignmentStore(fname).to_df()
+
 	# Load the file
 	f = load_fasta_file(fname)
 	
@@ -128,17 +147,82 @@ def get_df_from_file(fname):
 	
 	return df
 
-def preprocess_alignments(dirname, ow, particle):
+def _prep_outputs(fname, particle):
+	""" Files an earlier run may have written for the
+		alignment fname, in either format. """
+	outs = ['data/' + particle + '/' + get_fname(fname, f) 
+			for f in ['fasta', 'binary']]
+	return outs + [stats_path(get_fname(fname), particle)]
+
+def _remove_outputs(fname, particle):
+	""" Remove the earlier outputs of an alignment
+		which failed, so a stale copy is not encoded
+		by extract_features(). """
+	for out in _prep_outputs(fname, particle):
+		if os.path.exists(out):
+			os.remove(out)
+
+def _preprocess_file(path, fname, particle, fmt):
+	""" Preprocess one alignment and save it with
+		its column statistics. Returns the files
+		written.
+	"""
+	df = get_df_from_file(path)
+	anomalies = check_anomaly(df)
+	if anomalies:
+		df = replace_with_X(df, anomalies)
+		df = replace_X_with_mode(df)
+
+	# Output of an earlier run in the other format
+	other = 'data/' + particle + '/' + \
+		get_fname(fname, 'fasta' if fmt == 'binary' else 'binary')
+
+	# Save file as fasta or binary
+	fname = get_fname(fname, fmt)
+	if fmt == 'binary':
+		save = save_as_store
+	else:
+		save = save_as_fasta
+
+	out = 'data/' + particle + '/' + fname
+	save(df, out)
+
+	# Remove it, so the segment is not encoded twice
+	if os.path.exists(other):
+		os.remove(other)
+
+	# Save column statistics of the cleaned alignment
+	save_counts(column_counts(df), fname, particle)
+
+	return [out, stats_path(fname, particle)]
+
+def preprocess_alignments(dirname, ow, particle, fmt='fasta',
+						restart=False):
 	""" Function to preprocess all files in a directory.
+
+		The preprocessed files are saved as fasta, or
+		as binary alignments if fmt is 'binary'.
+
+		Finished files are recorded in a journal (see
+		checkpoint.py), so a rerun after a crash skips
+		them. A file which fails is quarantined with
+		its error and the others go on. Set restart
+		to True to do every file again.
+
+		Returns the quarantined files and their errors.
 	"""
 
+	journal = Journal('preprocess_' + particle, 
+		{'dirname': dirname, 'fmt': fmt}, restart)
+	resuming = bool(journal.entries)
+
 	# Create directories if not already existing
 	if particle == 'virus': 
 		# Check directory
 		if not os.path.exists('data/virus'):
 			# If doesn't exist, make a new one
 			os.makedirs('data/virus')
-		elif ow == True:
+		elif ow == True or resuming:
 			# Overwrite all pre-existing files
 			pass
 		else:
@@ -149,7 +233,7 @@ def preprocess_alignments(dirname, ow, particle):
 		if not os.path.exists('data/mouse'):
 			# If doesn't exist, make a new one
 			os.makedirs('data/mouse')
-		elif ow == True:
+		elif ow == True or resuming:
 			# Overwrite all pre-existing files
 			pass
 		else:
@@ -160,15 +244,48 @@ def preprocess_alignments(dirname, ow, particle):
 	print "Preprocessing files..."
 	with click.progressbar(os.listdir(dirname)) as bar:
 		for fname in bar:
-			df = get_df_from_file(dirname + '/' + fname)
-			anomalies = check_anomaly(df)
-			if anomalies:
-				df = replace_with_X(df, anomalies)
-				df = replace_X_with_mode(df)
-
-			# Save file as fasta
-			fname = get_fname(fname)
-			if particle == 'virus':
-				save_as_fasta(df, 'data/virus/' + fname)
-			else:
-				save_as_fasta(df, 'data/mouse/' + fname)
\ No newline at end of file
+			path = dirname + '/' + fname
+			if journal.is_done(path):
+				continue
+
+			try:
+				outputs = _preprocess_file(path, fname, particle, fmt)
+			except Exception as e:
+				journal.fail(path, e)
+				_remove_outputs(fname, particle)
+				continue
+			journal.done(path, outputs)
+
+	# Report the quarantined files
+	quarantined = journal.quarantined()
+	for path, err in sorted(quarantined.items()):
+		print "Quarantined", path + ":", err
+
+	return quarantined
+
+def main():
+	# Parser arguments
+	parser = argparse.ArgumentParser(
+		description='Preprocesses the aligned segments.')
+
+	parser.add_argument('-d', '--aligned_dir', nargs='?', 
+		default='data/aligned', type=str, 
+		help="Directory of alignments.")
+	parser.add_argument('-p', '--particle', nargs='?', 
+		choices=['virus', 'mouse'], type=str, 
+		help="'mouse' or 'virus'")
+	parser.add_argument('-f', '--format', nargs='?', 
+		choices=['fasta', 'binary'], default='fasta', 
+		type=str, help="Format of the preprocessed alignments.")
+	parser.add_argument('-ow', '--overwrite',
+		help="Set True to overwrite", action='store_true')
+	parser.add_argument('-r', '--restart',
+		help="Set True to ignore the checkpoint of an earlier run",
+		action='store_true')
+
+	args = parser.parse_args()
+	preprocess_alignments(args.aligned_dir, args.overwrite, 
+		args.particle, args.format, args.restart)
+
+if __name__ == "__main__":
+	main()
@@ -3,8 +3,9 @@
 import pickle
 import numpy as np
 
-from config import THRESHOLD
-from sklearn.decomposition import PCA, IncrementalPCA
+from config import THRESHOLD, PRECISION, STORAGE_PRECISION
+from sklearn.manifold import TSNE
+from sklearn.decomposition import PCA, IncrementalPCA, TruncatedSVD
 
 # Length of reduced data
 threshold_len = THRESHOLD
@@ -18,26 +19,119 @@ def remove_zeros(X):
 	X_t = np.delete(X_t, where_zeros, axis=0)
 	return X_t.T
 
+def features_fname(particle, index):
+	""" File name of the reduced features. """
+	return 'data/' + particle + '_' + index
+
+def save_reduced(keys, X, particle, index):
+	""" Save the reduced features to disc, as the
+		names and the matrix of features in
+		STORAGE_PRECISION.
+	"""
+	keys = np.asarray(keys, dtype=object)
+	X = np.asarray(X, dtype=STORAGE_PRECISION)
+	with open(features_fname(particle, index), 'w') as f:
+		pickle.dump((keys, X), f)
+
+def load_reduced(fname):
+	""" Load features saved by save_reduced() and
+		return the names and the feature matrix.
+		Files from before STORAGE_PRECISION, which
+		hold a single array with the names in the
+		first column, are read as well.
+	"""
+	with open(fname) as f:
+		X = pickle.load(f)
+
+	if isinstance(X, tuple):
+		return X
+	keys = np.array(X[:, 0], dtype=object)
+	return keys, np.array(X[:, 1:], dtype=np.float64)
+
+def reconstruction_error(reducer, X, X_reduced):
+	""" Relative error of reconstructing each row of X
+		from its reduced features. Rows which are all
+		zeros, like those pad_dict() makes for strains
+		without sequences, are left out.
+	"""
+	rows = X.any(axis=1)
+	X, X_reduced = X[rows], X_reduced[rows]
+
+	X_rec = reducer.inverse_transform(X_reduced)
+	norms = np.linalg.norm(X, axis=1)
+	return np.linalg.norm(X - X_rec, axis=1) / norms
+
+def sparse_error(X, X_reduced):
+	""" Relative error of reconstructing each row of a
+		sparse X from its truncated SVD, computed from
+		the norms so that X is never made dense.
+	"""
+	sq = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+	res = np.maximum(sq - (X_reduced ** 2).sum(axis=1), 0.0)
+	return np.sqrt(res) / np.maximum(np.sqrt(sq), 1e-12)
+
+def reduce_sparse(keys, X, particle, index, save=True, state=None):
+	""" Reduce a sparse matrix of features (eg. k-mer
+		counts) with a truncated SVD, without making
+		it dense.
+
+		state is filled in as by reduce_dimension(),
+		with no mask of non-zero columns.
+
+		Returns the names and the reduced features.
+	"""
+	keys = np.asarray(keys, dtype=object)
+
+	reducer = TruncatedSVD(n_components=threshold_len, random_state=0)
+	X_reduced = reducer.fit_transform(X)
+
+	if state is not None:
+		state['empty'] = list(keys[np.diff(X.tocsr().indptr) == 0])
+		state['nonzero'] = None
+		state['reducer'] = reducer
+		state['fit_error'] = sparse_error(X, X_reduced).mean()
+		state['n_fit'] = X.shape[0]
+
+	print "Shape of features after reduction =", X_reduced.shape
+
+	# Save to disc
+	if save:
+		print "Saving data..."
+		save_reduced(keys, X_reduced, particle, index)
+
+	return keys, X_reduced
+
 def reduce_dimension(features, particle, index,
-					method='ipca', save=True):
+					method='ipca', save=True, state=None):
 	""" Function to reduce the dimension of 
 		features using Incremental PCA.
 
 		Use when number of alignment files is
 		too large.
+
+		If a dictionary is passed as state, the fitted
+		reducer, the mask of non-zero columns, the
+		mean reconstruction error and the strains whose
+		features were all zeros are stored in it.
+
+		Returns the names and the reduced features.
 	"""
 
 	# Get names of the mice/viruses
-	keys = np.array(features.keys())
+	keys = np.array(features.keys(), dtype=object)
 
 	# Concatenate each set of feature vectors
 	X = features.values()
 	for i in range(len(X)):
 		X[i] = np.concatenate(X[i], axis=0)
-	X = np.vstack(X)
+	X = np.vstack(X).astype(PRECISION)
+
+	# Strains without any sequence, eg. placeholders
+	empty = keys[~X.any(axis=1)]
 
 	# Remove zeros
 	print "Removing zeros..."
+	nonzero = X.any(axis=0)
 	X = remove_zeros(X)
 	print "Shape of X after removing zeros =", X.shape
 
@@ -47,32 +141,37 @@ def reduce_dimension(features, particle, index,
 			batch_size=30)
 	elif method == 'pca':
 		reducer = PCA(n_components=threshold_len)
+	elif method == 'svd':
+		reducer = TruncatedSVD(n_components=threshold_len, 
+			random_state=0)
+	elif method == 't-sne':
+		# Barnes-Hut only supports up to 3 components
+		reducer = TSNE(n_components=threshold_len, method='exact')
 
 	# Reduce the features
 	X_reduced = reducer.fit_transform(X)
 
+	if state is not None:
+		state['empty'] = list(empty)
+		state['nonzero'] = nonzero
+		state['reducer'] = reducer
+		state['fit_error'] = None
+		if hasattr(reducer, 'inverse_transform'):
+			state['fit_error'] = reconstruction_error(reducer, 
+										X, X_reduced).mean()
+		state['n_fit'] = len(X)
+
 	# Check if any of the features is all zeros
 	for i in range(len(X_reduced)):
 		if np.array_equal(X_reduced[i], np.zeros(threshold_len,)):
 			err = "All zeros in sample for " + keys[i]
 			raise ValueError(err)
 
-	# Concatenate keys and reduced features
-	keys = keys.reshape((keys.shape[0], 1))
-	X = np.concatenate([keys, X_reduced], axis=1)
-
-	print "Shape of features after reduction =", X.shape
+	print "Shape of features after reduction =", X_reduced.shape
 
 	# Save to disc
 	if save:
 		print "Saving data..."
-		if particle == 'virus':
-			fname = 'data/virus_' + index
-			with open(fname, 'w') as f:
-				pickle.dump(X, f)
-	 	elif particle == 'mouse':
-			fname = 'data/mouse_' + index
-			with open(fname, 'w') as f:
-				pickle.dump(X, f)
-
-	return X
\ No newline at end of file
+		save_reduced(keys, X_reduced, particle, index)
+
+	return keys, X_reduced
\ No newline at end of file
@@ -0,0 +1,173 @@
+#!usr/bin/python
+
+import os
+import pickle
+import argparse
+import numpy as np
+
+from config import DATA_REPO, SHARED_DIR
+from reduce_dimension import features_fname, load_reduced
+
+def array_fname(name, dirname=SHARED_DIR):
+	""" File of a published array. """
+	return dirname + '/' + name + '.npy'
+
+def _stale(name, sources, dirname=SHARED_DIR):
+	""" Check if a published array is missing or
+		older than any of its source files. """
+	fname = array_fname(name, dirname)
+	if not os.path.exists(fname):
+		return True
+	mtime = os.path.getmtime(fname)
+	return any([os.path.getmtime(src) > mtime for src in sources])
+
+def publish(name, X, dirname=SHARED_DIR):
+	""" Write an array to a .npy file once so that
+		every worker can attach to it by name.
+
+		The file is renamed into place, so workers
+		never attach to a half written array.
+		Strings are stored with a fixed width, as
+		object arrays cannot be memory mapped.
+	"""
+	if not os.path.exists(dirname):
+		os.makedirs(dirname)
+
+	X = np.asarray(X)
+	if X.dtype == object:
+		X = X.astype(str)
+
+	fname = array_fname(name, dirname)
+	tmp = fname + '.' + str(os.getpid())
+	with open(tmp, 'wb') as f:
+		np.save(f, X)
+	os.rename(tmp, fname)
+
+	return fname
+
+def attach(name, dirname=SHARED_DIR):
+	""" Attach to a published array without copying
+		it. Processes attached to the same array
+		share its pages, so N workers hold one copy.
+	"""
+	return np.load(array_fname(name, dirname), mmap_mode='r')
+
+def publish_embeddings(particle, index, force=False,
+						dirname=SHARED_DIR):
+	""" Publish the names and the matrix of the
+		reduced features of a particle. """
+	name = particle + '_' + index
+	src = features_fname(particle, index)
+
+	if force or _stale(name + '_X', [src], dirname):
+		keys, X = load_reduced(src)
+		publish(name + '_keys', keys, dirname)
+		publish(name + '_X', X, dirname)
+
+def attach_embeddings(particle, index, dirname=SHARED_DIR):
+	""" Names and matrix of the reduced features, as
+		returned by knn_index.load_embeddings(). """
+	name = particle + '_' + index
+	return attach(name + '_keys', dirname), \
+		attach(name + '_X', dirname)
+
+def publish_graph(fname='data/graph_info.pkl', force=False,
+					dirname=SHARED_DIR):
+	""" Publish the edges of graph_info.pkl. """
+	if not force and not _stale('graph_ld50', [fname], dirname):
+		return
+
+	with open(fname) as f:
+		num_viruses, num_mice, u_nodes, v_nodes, ld50 = pickle.load(f)
+
+	publish('graph_sizes', [num_viruses, num_mice], dirname)
+	publish('graph_u', u_nodes, dirname)
+	publish('graph_v', v_nodes, dirname)
+	publish('graph_ld50', ld50, dirname)
+
+def attach_graph(dirname=SHARED_DIR):
+	""" The graph as the tuple of graph_info.pkl,
+		(num_viruses, num_mice, u_nodes, v_nodes, ld50).
+	"""
+	num_viruses, num_mice = attach('graph_sizes', dirname)
+	return int(num_viruses), int(num_mice), \
+		attach('graph_u', dirname), attach('graph_v', dirname), \
+		attach('graph_ld50', dirname)
+
+def _publish_dict(name, d, dirname):
+	keys = sorted(d)
+	publish(name + '_keys', keys, dirname)
+	publish(name + '_values', [d[k] for k in keys], dirname)
+
+def _attach_dict(name, dirname):
+	return dict(zip(attach(name + '_keys', dirname).tolist(),
+					attach(name + '_values', dirname).tolist()))
+
+def publish_registry(force=False, dirname=SHARED_DIR):
+	""" Publish orders and viruses_dict as arrays of
+		their keys and values. """
+	sources = [DATA_REPO + '/orders', DATA_REPO + '/viruses_dict']
+	if not force and not _stale('viruses_dict_values', sources,
+								dirname):
+		return
+
+	with open(DATA_REPO + '/orders') as f:
+		virus_order, mouse_order, _inv_v, _inv_m = pickle.load(f)
+	with open(DATA_REPO + '/viruses_dict') as f:
+		viruses_dict = pickle.load(f)
+
+	_publish_dict('virus_order', virus_order, dirname)
+	_publish_dict('mouse_order', mouse_order, dirname)
+	_publish_dict('viruses_dict', viruses_dict, dirname)
+
+def attach_registry(dirname=SHARED_DIR):
+	""" The orders tuple and viruses_dict, without
+		unpickling them. Only the small dictionaries
+		are built in each worker.
+	"""
+	virus_order = _attach_dict('virus_order', dirname)
+	mouse_order = _attach_dict('mouse_order', dirname)
+	viruses_dict = _attach_dict('viruses_dict', dirname)
+
+	inv_virus_order = dict((v, k) for k, v in virus_order.items())
+	inv_mouse_order = dict((v, k) for k, v in mouse_order.items())
+	orders = (virus_order, mouse_order, inv_virus_order, inv_mouse_order)
+
+	return orders, viruses_dict
+
+def publish_all(index='JOND920101', force=False, dirname=SHARED_DIR):
+	""" Publish everything which exists, before
+		starting the workers. """
+	publish_registry(force, dirname)
+
+	for particle in ['virus', 'mouse']:
+		if os.path.exists(features_fname(particle, index)):
+			publish_embeddings(particle, index, force, dirname)
+
+	if os.path.exists('data/graph_info.pkl'):
+		publish_graph('data/graph_info.pkl', force, dirname)
+
+def main():
+	# Parser arguments
+	parser = argparse.ArgumentParser(
+		description='Publishes embeddings and the graph ' + \
+					'for workers to attach to.')
+
+	parser.add_argument('-i', '--index', nargs='?',
+		default='JOND920101', type=str,
+		help="Index from AAindex used for the features.")
+	parser.add_argument('-f', '--force',
+		help="Set True to publish even if up to date",
+		action='store_true')
+
+	args = parser.parse_args()
+	publish_all(args.index, args.force)
+
+	for fname in sorted(os.listdir(SHARED_DIR)):
+		if not fname.endswith('.npy'):
+			continue
+		X = attach(fname[:-len('.npy')])
+		print fname, X.dtype, X.shape
+
+if __name__ == "__main__":
+	main()
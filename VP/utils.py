@@ -1,10 +1,19 @@
 #!usr/bin/python
 
+import re
 import pickle
 import argparse
 import numpy as np
 import pandas as pd
 
+# Matches identifiers ending in a bracketed version,
+# eg. 'A/Netherlands/602/2009(H1N1)'. Group 1 is everything
+# up to the last '(' and group 2 the bracketed version.
+_BRACKET_RE = re.compile(r'^(?:(.*)\(|)([^()]*)[^(]*\)$')
+
+# Memoised outputs of change_format()
+_FORMAT_CACHE = {}
+
 def pad_with_zero_vectors(X, threshold_len):
 	""" Pad a 2D array with 1D zero arrays to
 		achieve a threshold len.
@@ -30,13 +39,9 @@ def change_bracket(x):
 			String to process.
 	"""
 
-	if x.endswith(')'):
-		x = x.split('(')
-		l = x[-1]
-		x.pop()
-		l = l.split(')')[0]
-		x = '('.join(x)
-		x += '/' + l
+	m = _BRACKET_RE.match(x)
+	if m:
+		x = (m.group(1) or '') + '/' + m.group(2)
 	return x
 
 def change_format(x):
@@ -56,15 +61,60 @@ def change_format(x):
 		x: str
 			String to process.
 	"""
-	if x.endswith(')'):
-		x += '/1'
-	x = x.split('/')
-	l = x[-1]
-	x.pop()
-	x = '/'.join(x)
-	x = change_bracket(x)
-	x += '/' + l
-	return x
+	try:
+		return _FORMAT_CACHE[x]
+	except KeyError:
+		pass
+
+	y = x
+	if y.endswith(')'):
+		y += '/1'
+	head, _sep, l = y.rpartition('/')
+	y = change_bracket(head) + '/' + l
+
+	_FORMAT_CACHE[x] = y
+	return y
+
+def _bracket_repl(m):
+	""" Replacement used by change_brackets(). """
+	return (m.group(1) or '') + '/' + m.group(2)
+
+def change_brackets(ids):
+	""" Vectorised change_bracket() over a batch
+		of identifiers.
+
+		Parameters
+		----------
+		ids: list or pd.Series
+			Strings to process.
+
+		Returns
+		-------
+		pd.Series of the processed strings, in order.
+	"""
+	ids = pd.Series(ids, dtype=object)
+	return ids.str.replace(_BRACKET_RE, _bracket_repl)
+
+def change_formats(ids):
+	""" Vectorised change_format() over a batch
+		of identifiers. Eg. the 'Influenza_virus_name'
+		column of a CSV can be passed in directly.
+
+		Parameters
+		----------
+		ids: list or pd.Series
+			Strings to process.
+
+		Returns
+		-------
+		pd.Series of the processed strings, in order.
+	"""
+	ids = pd.Series(ids, dtype=object)
+	ends = ids.str.endswith(')')
+	ids = ids.where(~ends, ids + '/1')
+
+	parts = ids.str.rpartition('/')
+	return change_brackets(parts[0]) + '/' + parts[2]
 
 def create_ids(v, m):
 	""" Generate and store the ids from the graph
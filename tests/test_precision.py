@@ -0,0 +1,57 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'VP'))
+
+import reduce_dimension
+from config import THRESHOLD
+
+# Largest drift of the saved embeddings from float64,
+# relative to the largest reduced value
+BOUND = 1e-3
+
+def _features(n=120, width=600, seed=0):
+	""" Features of low rank with well separated
+		components, as a dict of segment lists like
+		the output of extract_features(). """
+	rng = np.random.RandomState(seed)
+	scales = np.linspace(10.0, 1.0, THRESHOLD)
+	U = rng.randn(n, THRESHOLD) * scales
+	X = U.dot(rng.randn(THRESHOLD, width)) + 0.01 * rng.randn(n, width)
+
+	# Two segments per strain
+	half = width // 2
+	return dict(('strain' + str(i), [X[i, :half], X[i, half:]])
+				for i in range(n))
+
+def _reduce(monkeypatch, tmpdir, precision, storage):
+	monkeypatch.setattr(reduce_dimension, 'PRECISION', precision)
+	monkeypatch.setattr(reduce_dimension, 'STORAGE_PRECISION', storage)
+	monkeypatch.chdir(tmpdir)
+	if not os.path.exists('data'):
+		os.makedirs('data')
+
+	reduce_dimension.reduce_dimension(_features(), 'virus', 'test',
+										method='pca', save=True)
+	keys, X = reduce_dimension.load_reduced(
+		reduce_dimension.features_fname('virus', 'test'))
+
+	order = np.argsort(keys)
+	return keys[order], np.asarray(X, dtype=np.float64)[order]
+
+@pytest.mark.parametrize('precision', ['float32', 'float16'])
+@pytest.mark.parametrize('storage', ['float32', 'float16'])
+def test_embedding_drift(monkeypatch, tmpdir, precision, storage):
+	keys, exact = _reduce(monkeypatch, tmpdir, 'float64', 'float64')
+	keys_p, approx = _reduce(monkeypatch, tmpdir, precision, storage)
+
+	assert list(keys) == list(keys_p)
+	assert approx.shape == (len(keys), THRESHOLD)
+
+	# Components are only defined up to their sign
+	signs = np.sign((exact * approx).sum(axis=0))
+	drift = np.abs(exact - approx * signs).max() / np.abs(exact).max()
+
+	assert drift < BOUND